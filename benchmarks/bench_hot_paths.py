@@ -0,0 +1,169 @@
+"""Times and memory-profiles the hot paths of the feature and model code on synthetic inputs of growing size,
+see synthetic.py, so that their scaling can be checked without downloading the datasets.
+
+Each hot path is run on its base size multiplied by every scale. For each size the best of the timed runs is
+reported, with its CPU time, its peak RSS (on Linux, the peak of the call itself) and the scaling exponent since
+the previous size: 1 means linear, 2 quadratic. An extra run traces the memory allocated by the call (python
+and numpy objects, not the GEOS geometries), which is not skewed by the memory kept by the allocator.
+
+Usage: python benchmarks/bench_hot_paths.py [--scales 1,2,4,8] [--only get_road_length_by_commune]
+    [--output report.json]
+"""
+import os
+import tempfile
+from typing import Any, Callable
+
+import click
+import geopandas as gpd
+import numpy as np
+from synthetic import (
+    LANE_TYPES,
+    make_baac_tables,
+    make_bike_lanes,
+    make_communes,
+    make_lines,
+    make_training_data,
+    write_vector_file,
+)
+
+from velosafe.data.accidents_preprocessing import preprocess_accidents_dfs
+from velosafe.data.bike_lane_processing import build_bike_lanes_features
+from velosafe.data.geometry_cache import build_geometry_cache, read_geometry_cache
+from velosafe.data.profiling import (
+    StageProfile,
+    collect_profiles,
+    enable_profiling,
+    profile_stage,
+    write_profile_report,
+)
+from velosafe.data.road_processing import get_road_length_by_commune
+
+# Number of communes of the synthetic region, the inputs of the other sizes are spread over them
+N_COMMUNES = 1_000
+
+
+def setup_accidents(size: int, folder: str) -> Callable[[], Any]:
+    codes, _ = make_communes(N_COMMUNES)
+    tables = make_baac_tables(size, codes)
+    return lambda: preprocess_accidents_dfs(
+        tables["characteristics"], tables["places"], tables["users"], tables["vehicles"]
+    )
+
+
+def setup_bike_lanes(size: int, folder: str) -> Callable[[], Any]:
+    codes, polygons = make_communes(N_COMMUNES)
+    lanes = make_bike_lanes(size, codes, polygons)
+    # As read from the lane_geometries cache: the attributes and the length of the lanes
+    measured = lanes.drop(columns="geometry").assign(length=lanes.length)
+    return lambda: build_bike_lanes_features(measured)
+
+
+def setup_bike_lanes_spatial(size: int, folder: str) -> Callable[[], Any]:
+    codes, polygons = make_communes(N_COMMUNES)
+    lanes = make_bike_lanes(size, codes, polygons)
+    communes = gpd.GeoDataFrame({"insee_com": codes}, geometry=polygons, crs="EPSG:2154")
+    return lambda: build_bike_lanes_features(lanes, 2154, df_communes=communes)
+
+
+def setup_roads(size: int, folder: str) -> Callable[[], Any]:
+    codes, polygons = make_communes(N_COMMUNES)
+    # Cached like the datasets by the geometry stages: the communes from WGS84, the roads in Lambert-93
+    communes_path = os.path.join(folder, f"commune_geometries_{size}.parquet")
+    communes_file = write_vector_file(
+        os.path.join(folder, f"communes_{size}.geojson"), polygons, {"insee_com": codes}, file_crs="EPSG:4326"
+    )
+    build_geometry_cache(communes_file, communes_path, ["insee_com"], source_crs="EPSG:4326")
+    roads_path = os.path.join(folder, f"road_geometries_{size}.parquet")
+    roads_file = write_vector_file(os.path.join(folder, f"roads_{size}.shp"), make_lines(size))
+    build_geometry_cache(roads_file, roads_path, source_crs="EPSG:2154")
+
+    def run() -> Any:
+        # Like the roads stage: the geometries are loaded from the caches, then overlaid
+        df_communes, communes = read_geometry_cache(communes_path, ["insee_com"])
+        roads = read_geometry_cache(roads_path)[1]
+        return get_road_length_by_commune(df_communes["insee_com"].to_numpy(), communes, roads)
+
+    return run
+
+
+def setup_stratified_sample(size: int, folder: str) -> Callable[[], Any]:
+    from velosafe.models import stratified_sample
+
+    df = make_training_data(size)
+    return lambda: stratified_sample(df.copy(), test_size=0.2)
+
+
+def setup_grid_search(size: int, folder: str) -> Callable[[], Any]:
+    from sklearn.linear_model import Ridge
+    from sklearn.preprocessing import StandardScaler
+
+    from velosafe.models import grid_search
+
+    df = make_training_data(size)
+    X, y = df[["population", "area", "length", "road length"] + LANE_TYPES], df["accident_num"]
+    return lambda: grid_search(Ridge(), {"alpha": [0.1, 1, 10, 100]}, X, y, scaler=StandardScaler())[1]
+
+
+# Name of each hot path: function preparing its inputs of a given size, and base size
+BENCHMARKS = {
+    "preprocess_accidents_dfs": (setup_accidents, 200_000),
+    "build_bike_lanes_features": (setup_bike_lanes, 200_000),
+    "build_bike_lanes_features[spatial]": (setup_bike_lanes_spatial, 20_000),
+    "get_road_length_by_commune": (setup_roads, 50_000),
+    "stratified_sample": (setup_stratified_sample, 10_000),
+    "grid_search": (setup_grid_search, 5_000),
+}
+
+
+def count_rows(result: Any) -> int | None:
+    if isinstance(result, tuple):
+        return sum(len(part) for part in result)
+    return len(result) if hasattr(result, "__len__") else None
+
+
+def runs(name: str) -> list[StageProfile]:
+    return [profile for profile in collect_profiles() if profile.name == name]
+
+
+@click.command()
+@click.option("--scales", default="1,2,4,8", help="Comma separated multipliers of the base size of each hot path.")
+@click.option("--only", multiple=True, type=click.Choice(list(BENCHMARKS)), help="Hot path to run, repeatable.")
+@click.option("--repeat", type=int, default=3, help="Number of runs of each size, the best one is reported.")
+@click.option("--output", type=click.Path(), help="Save the measures in a JSON report, like `datagen --profile`.")
+def main(scales, only, repeat, output):
+    enable_profiling()
+    best_profiles = []
+    with tempfile.TemporaryDirectory() as folder:
+        for name in only or BENCHMARKS:
+            setup, base_size = BENCHMARKS[name]
+            click.echo(name)
+            previous = None
+            for size in [int(base_size * float(scale)) for scale in scales.split(",")]:
+                run = setup(size, folder)
+                for _ in range(repeat):
+                    with profile_stage(name, rows_in=size) as profile:
+                        profile.rows_out = count_rows(run())
+                # The steps profiled inside the hot path, e.g. by get_road_length_by_commune, are recorded too
+                best = min(runs(name), key=lambda profile: profile.wall_time)
+                with profile_stage(name, rows_in=size, trace_allocations=True):
+                    run()
+                best.allocated = runs(name)[0].allocated
+                best_profiles.append(best)
+
+                exponent = ""
+                if previous is not None and previous.wall_time > 0:
+                    ratio = np.log(best.wall_time / previous.wall_time) / np.log(size / previous.rows_in)
+                    exponent = f", scaling x^{ratio:.2f}"
+                click.echo(
+                    f"  {size:>9} rows: {best.wall_time:>8.3f}s wall {best.cpu_time:>8.3f}s CPU "
+                    f"{best.allocated / 2**20:>8.1f} MiB allocated, {best.peak_rss / 2**20:>6.0f} MiB peak{exponent}"
+                )
+                previous = best
+
+    if output:
+        write_profile_report(best_profiles, output, {"scales": scales, "repeat": repeat})
+        click.echo(f"Report saved to {output}.")
+
+
+if __name__ == "__main__":
+    main()
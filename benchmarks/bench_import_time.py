@@ -0,0 +1,62 @@
+"""Measures the import time of the velosafe CLI with `python -X importtime`, and checks that the commands
+which do not build features start without importing the geo and machine learning stacks.
+Exits with an error if one of these modules is imported, or if the imports take longer than the budget.
+
+Usage: python benchmarks/bench_import_time.py [--budget MILLISECONDS]
+"""
+import subprocess
+import sys
+
+import click
+
+# Modules that take hundreds of milliseconds to import, and that `--help` and `download` do not need
+HEAVY_MODULES = ["fiona", "geopandas", "joblib", "orjson", "pandas", "py7zr", "pyproj", "shapely", "sklearn"]
+COMMANDS = [["--help"], ["download", "--help"], ["datagen", "--help"], ["accidents", "--help"]]
+
+
+def import_times(args: list[str]) -> dict[str, tuple[int, int]]:
+    """Runs the CLI with some arguments and collects the import time of each module.
+
+    Args:
+        args (list[str]): arguments of `python -m velosafe`
+
+    Returns:
+        dict[str, tuple[int, int]]: the self and cumulative import times of each module, in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "velosafe", *args], capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(self_time), int(cumulative))
+    return times
+
+
+@click.command()
+@click.option("--budget", type=float, default=300, help="Maximum import time of a command, in milliseconds.")
+@click.option("--repeat", type=int, default=3, help="Number of runs of each command, the best one is reported.")
+@click.option("--top", type=int, default=5, help="Number of slowest top-level imports to list.")
+def main(budget, repeat, top):
+    failed = False
+    for args in COMMANDS:
+        runs = [import_times(args) for _ in range(repeat)]
+        times = min(runs, key=lambda times: sum(self_time for self_time, _ in times.values()))
+        total = sum(self_time for self_time, _ in times.values()) / 1000
+        heavy = sorted({name.split(".")[0] for name in times} & set(HEAVY_MODULES))
+        click.echo(f"velosafe {' '.join(args)}: {total:.0f}ms, {len(times)} modules")
+        slowest = sorted(((cumulative, name) for name, (_, cumulative) in times.items() if "." not in name))[::-1]
+        for cumulative, name in slowest[:top]:
+            click.echo(f"  {cumulative / 1000:>7.1f}ms {name}")
+        if heavy:
+            click.echo(f"  imports {', '.join(heavy)}", err=True)
+        if total > budget:
+            click.echo(f"  over the budget of {budget:.0f}ms", err=True)
+        failed |= bool(heavy) or total > budget
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
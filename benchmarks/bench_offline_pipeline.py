@@ -0,0 +1,157 @@
+"""Runs the whole pipeline without the network: `download` and `datagen` from a local mirror serving the fixture
+bundle of offline.py, then a grid search on the training matrix. Reports the time and throughput of each phase,
+and checks the training matrix against the totals of the generated datasets.
+
+The downloads go through a local HTTP server, which also serves the Range requests resuming an interrupted
+download, unless --file-mirror is given: the bundle folder is then used as the mirror. The second `datagen` run
+measures the pipeline when every stage is up to date.
+Exits with an error if a check fails.
+
+Usage: python benchmarks/bench_offline_pipeline.py [--communes 200] [--accidents 20000] [--jobs 2]
+    [--bundle DIR] [--file-mirror] [--output report.json]
+"""
+import os
+import sys
+import tempfile
+from contextlib import ExitStack
+
+import click
+import numpy as np
+import shapely
+from click.testing import CliRunner
+from offline import make_fixture_bundle, serve_folder
+from synthetic import X0, Y0, make_baac_tables, make_bike_lanes, make_communes, make_lines
+
+from velosafe.__main__ import cli
+from velosafe.data import Datasets
+from velosafe.data.accidents_preprocessing import build_accidents_features
+from velosafe.data.bike_lane_processing import build_bike_lanes_features
+from velosafe.data.download import MIRROR_ENV_VAR
+from velosafe.data.feature_store import read_features
+from velosafe.data.profiling import collect_profiles, enable_profiling, profile_stage, write_profile_report
+
+# Relative tolerance of the lengths, which are projected back and forth between Lambert-93 and WGS84
+LENGTH_RTOL = 1e-4
+
+
+def run_command(args: list[str]) -> None:
+    result = CliRunner().invoke(cli, args, catch_exceptions=False)
+    if result.exit_code != 0:
+        raise click.ClickException(f"velosafe {' '.join(args)} failed:\n{result.output}")
+
+
+def expected_totals(n_communes: int, n_accidents: int, n_lanes: int, n_roads: int, extent: float) -> dict:
+    # Totals of the features, computed from the generated datasets without the pipeline
+    codes, polygons = make_communes(n_communes, extent)
+    tables = make_baac_tables(n_accidents, codes, extent)
+    lanes = make_bike_lanes(n_lanes, codes, polygons, extent)
+    bike_lanes = build_bike_lanes_features(lanes.drop(columns="geometry").assign(length=lanes.length))
+    region = shapely.box(X0, Y0, X0 + extent, Y0 + extent)
+    return {
+        "communes": len(codes),
+        "accident_num": build_accidents_features(
+            tables["characteristics"], tables["places"], tables["users"], tables["vehicles"]
+        )["accident_num"].sum(),
+        "length": bike_lanes["length"].sum(),
+        "road length": shapely.length(shapely.intersection(make_lines(n_roads, extent), region)).sum(),
+    }
+
+
+def check_resume(bundle: str, folder: str) -> bool:
+    # Downloads the archive again after an interruption halfway through, which resumes with a Range request
+    archive = Datasets.ROADS
+    with open(os.path.join(bundle, archive.filename), "rb") as f:
+        content = f.read()
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, archive.filename + ".part"), "wb") as f:
+        f.write(content[: len(content) // 2])
+    with open(archive.download(folder, show_progress=False), "rb") as f:
+        return f.read() == content
+
+
+@click.command()
+@click.option("--communes", "n_communes", type=int, default=200, help="Approximate number of communes.")
+@click.option("--accidents", "n_accidents", type=int, default=20_000, help="Number of accidents.")
+@click.option("--lanes", "n_lanes", type=int, default=5_000, help="Number of bike lanes.")
+@click.option("--roads", "n_roads", type=int, default=5_000, help="Number of road segments.")
+@click.option("--extent", type=float, default=20_000, help="Size of the side of the region, in metres.")
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, help="Number of stages run concurrently.")
+@click.option("--bundle", type=click.Path(), help="Keep the fixture bundle in this folder.")
+@click.option("--file-mirror", is_flag=True, help="Use the bundle folder as the mirror, instead of an HTTP server.")
+@click.option("--skip-train", is_flag=True, help="Stop after datagen, e.g. without scikit-learn.")
+@click.option("--output", type=click.Path(), help="Save the measures in a JSON report, like `datagen --profile`.")
+def main(n_communes, n_accidents, n_lanes, n_roads, extent, jobs, bundle, file_mirror, skip_train, output):
+    enable_profiling()
+    failed = []
+    with ExitStack() as stack:
+        folder = stack.enter_context(tempfile.TemporaryDirectory())
+        bundle = bundle or os.path.join(folder, "mirror")
+        data_folder = os.path.join(folder, "data")
+
+        with profile_stage("fixture bundle") as bundle_profile:
+            checksums = make_fixture_bundle(bundle, n_communes, n_accidents, n_lanes, n_roads, extent)
+        size = sum(os.path.getsize(os.path.join(bundle, name)) for name in checksums)
+        click.echo(
+            f"Fixture bundle: {len(checksums)} files, {size / 2**20:.1f} MiB, in {bundle_profile.wall_time:.2f}s"
+        )
+
+        mirror = bundle if file_mirror else stack.enter_context(serve_folder(bundle))
+        # The commands set it too, but the resume check downloads without them
+        os.environ[MIRROR_ENV_VAR] = mirror
+        click.echo(f"Mirror: {mirror}")
+
+        with profile_stage("download", rows_in=len(checksums)) as download_profile:
+            run_command(["download", "all", data_folder, "--mirror", mirror])
+        click.echo(
+            f"download: {download_profile.wall_time:.2f}s, {size / 2**20 / download_profile.wall_time:.1f} MiB/s"
+        )
+        if not file_mirror and not check_resume(bundle, os.path.join(folder, "resume")):
+            failed.append("the resumed download differs from the archive")
+
+        datagen = ["datagen", data_folder, "--jobs", str(jobs), "--mirror", mirror]
+        for name in ("datagen", "datagen (up to date)"):
+            with profile_stage(name, rows_in=n_accidents) as profile:
+                run_command(datagen)
+            click.echo(f"{name}: {profile.wall_time:.2f}s, {n_accidents / profile.wall_time:,.0f} accidents/s")
+
+        from velosafe.data.build_features import TRAINING_STAGE
+
+        training_data = read_features(TRAINING_STAGE.output_path(data_folder))
+        expected = expected_totals(n_communes, n_accidents, n_lanes, n_roads, extent)
+        actual = {
+            "communes": len(training_data),
+            "accident_num": training_data["accident_num"].sum(),
+            "length": training_data["length"].sum(),
+            "road length": training_data["road length"].sum(),
+        }
+        for name, value in expected.items():
+            rtol = LENGTH_RTOL if "length" in name else 0
+            ok = np.isclose(actual[name], value, rtol=rtol, atol=0)
+            click.echo(f"  {name:<14} {actual[name]:>14,.1f} expected {value:>14,.1f} {'ok' if ok else 'MISMATCH'}")
+            if not ok:
+                failed.append(f"{name}: {actual[name]} instead of {value}")
+
+        if not skip_train:
+            from sklearn.linear_model import Ridge
+            from sklearn.preprocessing import StandardScaler
+
+            from velosafe.models import grid_search
+
+            X = training_data.drop(columns=["code_commune", "accident_num"])
+            with profile_stage("train", rows_in=len(X)) as profile:
+                _, results = grid_search(
+                    Ridge(), {"alpha": [0.1, 1, 10, 100]}, X, training_data["accident_num"], scaler=StandardScaler()
+                )
+            click.echo(f"train: {profile.wall_time:.2f}s, {len(results)} models")
+
+    if output:
+        command = {"communes": n_communes, "accidents": n_accidents, "lanes": n_lanes, "roads": n_roads, "jobs": jobs}
+        write_profile_report(collect_profiles(), output, command)
+        click.echo(f"Report saved to {output}.")
+    for failure in failed:
+        click.echo(f"Check failed: {failure}", err=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
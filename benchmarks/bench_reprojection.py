@@ -0,0 +1,49 @@
+"""Compares the reprojection of the INSEE 2015 communes done one polygon at a time in a joblib pool,
+as build_roads_features used to do, with the vectorized `project_geometries`.
+
+Usage: python benchmarks/bench_reprojection.py [DATA_FOLDER]
+"""
+import os
+import time
+
+import click
+import numpy as np
+import pyproj
+import shapely
+from joblib import Parallel, delayed
+from shapely.ops import transform
+
+from velosafe.data import Datasets
+from velosafe.data.projection import project_geometries
+from velosafe.data.readers import read_geometries
+
+
+def project_with_joblib(geometries: np.ndarray, from_crs: str, to_crs: str) -> list:
+    project = pyproj.Transformer.from_crs(pyproj.CRS(from_crs), pyproj.CRS(to_crs), always_xy=True).transform
+    return Parallel(n_jobs=-1)(delayed(transform)(project, geom) for geom in geometries)
+
+
+@click.command()
+@click.argument("data_folder", type=click.Path(exists=True), required=False, default="./data")
+@click.option("--repeat", type=int, default=3, help="Number of runs of each method, the best one is reported.")
+def main(data_folder, repeat):
+    _, communes = read_geometries(os.path.join(data_folder, Datasets.INSEE_COM.filename), columns=["insee_com"])
+    click.echo(f"{len(communes)} communes, {shapely.get_num_coordinates(communes).sum()} coordinates")
+
+    timings = {}
+    for name, method in [("joblib", project_with_joblib), ("vectorized", project_geometries)]:
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            projected = method(communes, "EPSG:4326", "EPSG:2154")
+            durations.append(time.perf_counter() - start)
+        timings[name] = min(durations)
+        click.echo(f"{name:>10}: {timings[name]:.3f}s")
+
+    reference = np.asarray(project_with_joblib(communes, "EPSG:4326", "EPSG:2154"), dtype=object)
+    assert shapely.equals_exact(reference, projected, tolerance=1e-6).all()
+    click.echo(f"speedup: x{timings['joblib'] / timings['vectorized']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
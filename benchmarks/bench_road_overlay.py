@@ -0,0 +1,37 @@
+"""Times the commune/road overlay of get_road_length_by_commune on synthetic networks of growing size,
+with and without the containment shortcut, and checks that both give the same lengths.
+Both are checked against a plain pair by pair intersection by check_correctness.py.
+
+Usage: python benchmarks/bench_road_overlay.py
+"""
+import time
+
+import click
+import numpy as np
+from shapely import STRtree
+from synthetic import make_communes, make_lines
+
+from velosafe.data.overlay import intersection_lengths
+
+
+@click.command()
+@click.option("--sizes", default="10000,100000,500000", help="Comma separated numbers of roads.")
+@click.option("--communes", "n_communes", type=int, default=2000, help="Number of communes.")
+def main(sizes, n_communes):
+    _, communes = make_communes(n_communes)
+    for n_roads in map(int, sizes.split(",")):
+        roads = make_lines(n_roads)
+        tree = STRtree(roads)
+        pairs = tree.query(communes, predicate="intersects")
+
+        results = {}
+        for shortcut in (False, True):
+            start = time.perf_counter()
+            results[shortcut] = intersection_lengths(roads, communes, pairs, containment_shortcut=shortcut)
+            click.echo(f"{n_roads:>8} roads, shortcut={shortcut!s:<5}: {time.perf_counter() - start:.3f}s")
+
+        np.testing.assert_allclose(results[True], results[False], rtol=1e-9)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Checks the optimized feature code against plain reference implementations on synthetic data, see
+synthetic.py, so that a regression shared by all the code paths of a function is caught too.
+Exits with an error if a check fails.
+
+Usage: python benchmarks/check_correctness.py [--only road_lengths]
+"""
+import sys
+
+import click
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from synthetic import X0, Y0, make_bike_lanes, make_communes, make_lines
+
+from velosafe.data.bike_lane_processing import (
+    build_bike_lanes_features,
+    fast_compute_bike_lane_length_per_commune,
+    get_lane_distances,
+)
+from velosafe.data.road_processing import get_road_length_by_commune
+
+N_COMMUNES = 300
+EXTENT = 20_000
+
+
+def reference_lengths(codes: np.ndarray, polygons: np.ndarray, lines: np.ndarray) -> pd.Series:
+    # Intersects every line with every commune it crosses, one pair at a time
+    lengths = {}
+    for code, polygon in zip(codes, polygons):
+        crossing = lines[shapely.intersects(polygon, lines)]
+        if len(crossing):
+            lengths[code] = sum(shapely.intersection(line, polygon).length for line in crossing)
+    return pd.Series(lengths, dtype=float).sort_index()
+
+
+def check_road_lengths() -> None:
+    codes, polygons = make_communes(N_COMMUNES, EXTENT)
+    roads = make_lines(5_000, EXTENT)
+    expected = reference_lengths(codes, polygons, roads)
+    for shortcut in (True, False):
+        actual = get_road_length_by_commune(codes, polygons, roads, chunk_size=1_000, containment_shortcut=shortcut)
+        actual = actual.set_index("insee_com")["road length"].sort_index()
+        pd.testing.assert_index_equal(actual.index, expected.index, check_names=False)
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, err_msg=f"containment_shortcut={shortcut}")
+
+
+def check_bike_lane_attribution() -> None:
+    # Lanes inside the commune of their "code_com_*" attributes, which both attributions must agree on
+    codes, polygons = make_communes(N_COMMUNES, EXTENT)
+    lanes = make_bike_lanes(5_000, codes, polygons, EXTENT)
+    polygon_of_lane = pd.Series(polygons, index=codes)[lanes["code_com_d"]].to_numpy()
+    lanes = lanes[shapely.contains(polygon_of_lane, lanes.geometry.values.data)].reset_index(drop=True)
+    communes = gpd.GeoDataFrame({"insee_com": codes}, geometry=polygons, crs="EPSG:2154")
+
+    attribute = build_bike_lanes_features(lanes.drop(columns="geometry").assign(length=lanes.length))
+    spatial = build_bike_lanes_features(lanes, 2154, df_communes=communes)
+    pd.testing.assert_frame_equal(
+        spatial.set_index("insee_com").sort_index(), attribute.set_index("insee_com").sort_index(), rtol=1e-9
+    )
+
+    # Without types, e.g. OpenStreetMap extracts, each lane counts once in its commune
+    untyped = lanes.drop(columns=["ame_d", "ame_g", "code_com_d", "code_com_g"])
+    expected = pd.Series(lanes.length.to_numpy(), index=lanes["code_com_d"]).groupby(level=0).sum()
+    for name, features in {
+        "build_bike_lanes_features": build_bike_lanes_features(untyped, 2154, df_communes=communes),
+        "fast_compute_bike_lane_length_per_commune": fast_compute_bike_lane_length_per_commune(untyped, communes, 2154),
+    }.items():
+        actual = features.set_index("insee_com")["length"].sort_index()
+        pd.testing.assert_index_equal(actual.index, expected.index, check_names=False)
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, err_msg=name)
+
+
+def check_lane_distances() -> None:
+    codes, polygons = make_communes(N_COMMUNES, EXTENT)
+    lanes = make_bike_lanes(2_000, codes, polygons, EXTENT)
+    geometries = lanes.geometry.values.data
+    rng = np.random.default_rng(1)
+    points = shapely.points(rng.uniform((X0, Y0), (X0 + EXTENT, Y0 + EXTENT), size=(2_000, 2)))
+    # Accidents without a location
+    points[::50] = None
+    max_distance = 200
+
+    distances = get_lane_distances(points, geometries, lanes[["ame_d", "ame_g"]], max_distance)
+    # Distance from every point to every lane, NaN for the points without a location
+    all_distances = shapely.distance(points[:, np.newaxis], geometries[np.newaxis, :])
+    for column in distances:
+        lane_type = column.removeprefix("distance").removeprefix("_")
+        if lane_type:
+            has_type = (lanes["ame_d"] == lane_type) | (lanes["ame_g"] == lane_type)
+        else:
+            has_type = (lanes["ame_d"] != "AUCUN") | (lanes["ame_g"] != "AUCUN")
+        expected = np.where(has_type.to_numpy(), all_distances, np.inf).min(axis=1)
+        expected[expected > max_distance] = np.nan
+        np.testing.assert_allclose(distances[column], expected, rtol=1e-9, err_msg=column)
+
+
+# Name of each check, and the function raising an AssertionError if it fails
+CHECKS = {
+    "road_lengths": check_road_lengths,
+    "bike_lane_attribution": check_bike_lane_attribution,
+    "lane_distances": check_lane_distances,
+}
+
+
+@click.command()
+@click.option("--only", multiple=True, type=click.Choice(list(CHECKS)), help="Check to run, repeatable.")
+def main(only):
+    failed = False
+    for name in only or CHECKS:
+        try:
+            CHECKS[name]()
+            click.echo(f"{name}: ok")
+        except AssertionError as error:
+            click.echo(f"{name}: FAILED\n{error}", err=True)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
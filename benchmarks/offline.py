@@ -0,0 +1,158 @@
+"""A small bundle of synthetic datasets, saved under the names of the files of `Datasets`, and a local HTTP
+server to serve it as a mirror of the datasets (see VELOSAFE_MIRROR), so that the whole pipeline can run
+without the network.
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Iterator
+
+import geopandas as gpd
+import numpy as np
+import py7zr
+import shapely
+from synthetic import X0, Y0, make_baac_tables, make_bike_lanes, make_communes, make_lines, write_vector_file
+
+from velosafe.data import Datasets
+from velosafe.data.download import MIRROR_CHECKSUMS_FILENAME
+
+# Tables of `make_baac_tables`, and the dataset they are saved as
+BAAC_FILES = {
+    "characteristics": Datasets.ACCIDENTS_CHARACTERISTICS,
+    "places": Datasets.ACCIDENTS_PLACES,
+    "users": Datasets.ACCIDENTS_USERS,
+    "vehicles": Datasets.ACCIDENTS_VEHICULES,
+}
+
+
+def make_fixture_bundle(
+    folder: str,
+    n_communes: int = 200,
+    n_accidents: int = 20_000,
+    n_lanes: int = 5_000,
+    n_roads: int = 5_000,
+    extent: float = 20_000,
+    seed: int = 0,
+) -> dict[str, str]:
+    """Generates a file for each dataset of `Datasets`, in the format of the original: the communes, the bike
+    lanes and the départements in GeoJSON (WGS84), the BAAC tables in CSV, and the roads in a shapefile
+    inside a 7z archive, at the path of the original archive. The md5 checksums of the files are listed in
+    MIRROR_CHECKSUMS_FILENAME, since they differ from the ones of the datasets.
+
+    Args:
+        folder (str): destination folder, the root of the mirror
+        n_communes (int, optional): approximate number of communes. Defaults to 200.
+        n_accidents (int, optional): number of accidents, of all vehicles. Defaults to 20 000.
+        n_lanes (int, optional): number of bike lanes. Defaults to 5 000.
+        n_roads (int, optional): number of road segments. Defaults to 5 000.
+        extent (float, optional): size of the side of the region, in metres. Defaults to 20 km.
+        seed (int, optional): seed of the random generators. Defaults to 0.
+
+    Returns:
+        dict[str, str]: the md5 checksum of each file
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    codes, polygons = make_communes(n_communes, extent, seed)
+    centroids = gpd.GeoSeries(shapely.centroid(polygons), crs="EPSG:2154").to_crs("EPSG:4326")
+    communes = {
+        "insee_com": codes,
+        "population": np.round(rng.lognormal(6.5, 1.5, len(codes))).astype(int),
+        "x_centroid": centroids.y.to_numpy(),
+        "y_centroid": centroids.x.to_numpy(),
+        # In square kilometres
+        "superficie": shapely.area(polygons) / 1e6,
+    }
+    write_vector_file(os.path.join(folder, Datasets.INSEE_COM.filename), polygons, communes, file_crs="EPSG:4326")
+
+    lanes = make_bike_lanes(n_lanes, codes, polygons, extent, seed)
+    lanes.to_crs("EPSG:4326").to_file(os.path.join(folder, Datasets.CYCLING_LANES.filename), driver="GeoJSON")
+
+    for table, df in make_baac_tables(n_accidents, codes, extent, seed=seed).items():
+        df.to_csv(os.path.join(folder, BAAC_FILES[table].filename), sep=";", index=False)
+
+    departments = sorted({code[:2] for code in codes})
+    gpd.GeoDataFrame(
+        {"code": departments}, geometry=[shapely.box(X0, Y0, X0 + extent, Y0 + extent)] * len(departments), crs=2154
+    ).to_crs("EPSG:4326").to_file(os.path.join(folder, Datasets.DEPARTMENTS.filename), driver="GeoJSON")
+
+    _write_roads_archive(os.path.join(folder, Datasets.ROADS.filename), make_lines(n_roads, extent, seed=seed))
+
+    checksums = {}
+    for name in sorted(os.listdir(folder)):
+        if name != MIRROR_CHECKSUMS_FILENAME:
+            with open(os.path.join(folder, name), "rb") as f:
+                checksums[name] = hashlib.md5(f.read()).hexdigest()
+    with open(os.path.join(folder, MIRROR_CHECKSUMS_FILENAME), "w") as f:
+        json.dump(checksums, f, indent=2)
+    return checksums
+
+
+def _write_roads_archive(path: str, roads: np.ndarray) -> None:
+    # The shapefile is archived with all its sidecar files, like in the ROUTE 500 archive, of which only the
+    # files listed in `path_files_to_keep` are extracted
+    member = next(iter(Datasets.ROADS.path_files_to_keep))
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        write_vector_file(os.path.join(tmp_folder, os.path.basename(member)), roads)
+        with py7zr.SevenZipFile(path, "w") as archive:
+            for name in sorted(os.listdir(tmp_folder)):
+                archive.write(os.path.join(tmp_folder, name), f"{os.path.dirname(member)}/{name}")
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves the files of a folder, and the "Range: bytes=<start>-[<end>]" requests used to resume downloads."""
+
+    def send_head(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        start = int(match[1])
+        end = min(int(match[2]), size - 1) if match[2] else size - 1
+        if start >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        with open(path, "rb") as f:
+            f.seek(start)
+            content = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        return BytesIO(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_folder(folder: str) -> Iterator[str]:
+    """Serves the files of a folder over HTTP on localhost, in a thread, while in the context.
+
+    Args:
+        folder (str): the folder to serve
+
+    Yields:
+        str: the base URL of the server
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(RangeRequestHandler, directory=folder))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,253 @@
+"""Seeded generators of synthetic inputs, so that the hot paths can be measured without downloading the datasets.
+
+All the geometries are generated in a projected coordinate system (unit = metre), inside a square
+of `extent` metres whose lower left corner is (x0, y0): by default a region of Lambert-93 around Paris.
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+from shapely import STRtree
+
+X0, Y0 = 600_000, 6_800_000
+# Columns of the BAAC places table filled with small random categories
+PLACES_COLUMNS = [
+    "catr", "voie", "v1", "v2", "circ", "nbv", "vosp", "prof", "pr", "pr1", "plan", "lartpc", "larrout",
+    "surf", "infra", "situ", "vma",
+]  # fmt: skip
+# Values of the "ame_d" and "ame_g" attributes of the bike lanes dataset, "AUCUN" meaning no lane on that side
+LANE_TYPES = [
+    "ACCOTEMENT REVETU HORS CVCB", "AMENAGEMENT MIXTES PIETON VELO HORS VOIE VERTE", "AUTRE", "BANDE CYCLABLE",
+    "CHAUSSEE A VOIE CENTRALE BANALISEE", "COULOIR BUS+VELO", "DOUBLE SENS CYCLABLE BANDE",
+    "DOUBLE SENS CYCLABLE NON MATERIALISE", "DOUBLE SENS CYCLABLE PISTE", "GOULOTTE", "PISTE CYCLABLE", "VELO RUE",
+    "VOIE VERTE",
+]  # fmt: skip
+
+
+def make_communes(n_communes: int, extent: float = 50_000, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Generates communes as the Voronoi cells of random points.
+
+    Args:
+        n_communes (int): approximate number of communes
+        extent (float, optional): size of the side of the region, in metres. Defaults to 50 km.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the INSEE codes of the communes and their polygons
+    """
+    rng = np.random.default_rng(seed)
+    region = shapely.box(X0, Y0, X0 + extent, Y0 + extent)
+    points = shapely.multipoints(rng.uniform((X0, Y0), (X0 + extent, Y0 + extent), size=(n_communes, 2)))
+    cells = shapely.get_parts(shapely.voronoi_polygons(points, extend_to=region))
+    polygons = shapely.intersection(cells, region)
+    codes = np.array([f"{75 + i // 1000}{i % 1000:03d}" for i in range(len(polygons))], dtype=object)
+    return codes, polygons
+
+
+def make_lines(
+    n_lines: int, extent: float = 50_000, mean_length: float = 500, n_vertices: int = 5, seed: int = 0
+) -> np.ndarray:
+    """Generates random polylines, such as road or bike lane segments.
+
+    Args:
+        n_lines (int): number of lines
+        extent (float, optional): size of the side of the region, in metres. Defaults to 50 km.
+        mean_length (float, optional): mean length of the lines, in metres. Defaults to 500.
+        n_vertices (int, optional): number of vertices of each line. Defaults to 5.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        np.ndarray: array of shapely lines
+    """
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform((X0, Y0), (X0 + extent, Y0 + extent), size=(n_lines, 1, 2))
+    step_lengths = rng.exponential(mean_length / (n_vertices - 1), size=(n_lines, n_vertices - 1, 1))
+    headings = rng.uniform(0, 2 * np.pi, size=(n_lines, 1, 1)) + rng.normal(0, 0.3, size=(n_lines, n_vertices - 1, 1))
+    steps = step_lengths * np.concatenate([np.cos(headings), np.sin(headings)], axis=2)
+    coords = np.concatenate([starts, starts + np.cumsum(steps, axis=1)], axis=1)
+    return shapely.linestrings(coords)
+
+
+def make_baac_tables(
+    n_accidents: int, commune_codes: np.ndarray, extent: float = 50_000, year: int = 2021, seed: int = 0
+) -> dict[str, pd.DataFrame]:
+    """Generates the four tables of a BAAC release (characteristics, places, users and vehicles),
+    with the columns of the 2021 files. About one accident in twelve involves a bike.
+
+    Args:
+        n_accidents (int): number of accidents
+        commune_codes (np.ndarray): INSEE codes among which the commune of each accident is drawn
+        extent (float, optional): size of the side of the region where the accidents happen, in metres.
+            Defaults to 50 km.
+        year (int, optional): year of the accidents. Defaults to 2021.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        dict[str, pd.DataFrame]: the "characteristics", "places", "users" and "vehicles" tables
+    """
+    rng = np.random.default_rng(seed)
+    num_acc = year * 100_000_000 + np.arange(n_accidents)
+    communes = rng.choice(commune_codes, n_accidents)
+    x, y = rng.uniform((X0, Y0), (X0 + extent, Y0 + extent), size=(n_accidents, 2)).T
+    longitude, latitude = pyproj.Transformer.from_crs("EPSG:2154", "EPSG:4326", always_xy=True).transform(x, y)
+
+    def french_decimal(values: np.ndarray) -> np.ndarray:
+        return np.char.replace(np.char.mod("%.10f", values), ".", ",")
+
+    characteristics = pd.DataFrame(
+        {
+            "Num_Acc": num_acc,
+            "jour": rng.integers(1, 29, n_accidents),
+            "mois": rng.integers(1, 13, n_accidents),
+            "an": year,
+            "hrmn": "12:00",
+            "lum": rng.integers(1, 6, n_accidents),
+            "dep": [code[:2] for code in communes],
+            "com": communes,
+            "agg": rng.integers(1, 3, n_accidents),
+            "int": rng.integers(1, 10, n_accidents),
+            "atm": rng.integers(1, 10, n_accidents),
+            "col": rng.integers(1, 8, n_accidents),
+            "adr": "RUE DE LA PAIX",
+            "lat": french_decimal(latitude),
+            "long": french_decimal(longitude),
+        }
+    )
+    places = pd.DataFrame(
+        {"Num_Acc": num_acc, **{column: rng.integers(1, 5, n_accidents) for column in PLACES_COLUMNS}}
+    )
+    places["situ"] = rng.integers(1, 7, n_accidents)
+
+    # One to three vehicles per accident, a tenth of them being bikes (catv = 1)
+    n_vehicles = rng.integers(1, 4, n_accidents)
+    vehicle_acc = np.repeat(num_acc, n_vehicles)
+    vehicles = pd.DataFrame(
+        {
+            "Num_Acc": vehicle_acc,
+            "id_vehicule": np.arange(len(vehicle_acc)),
+            "num_veh": "A01",
+            "senc": rng.integers(0, 3, len(vehicle_acc)),
+            "catv": np.where(rng.random(len(vehicle_acc)) < 0.04, 1, 7),
+            "obs": 0,
+            "obsm": 2,
+            "choc": rng.integers(0, 9, len(vehicle_acc)),
+            "manv": rng.integers(1, 26, len(vehicle_acc)),
+            "motor": 1,
+            "occutc": np.nan,
+        }
+    )
+    # One or two users per vehicle
+    n_users = rng.integers(1, 3, len(vehicle_acc))
+    users = pd.DataFrame(
+        {
+            "Num_Acc": np.repeat(vehicle_acc, n_users),
+            "id_vehicule": np.repeat(vehicles["id_vehicule"].to_numpy(), n_users),
+            "num_veh": "A01",
+            "place": 1,
+            "catu": 1,
+            "grav": rng.integers(1, 5, n_users.sum()),
+            "sexe": rng.integers(1, 3, n_users.sum()),
+            "an_nais": rng.integers(1940, 2015, n_users.sum()),
+            "trajet": rng.integers(0, 10, n_users.sum()),
+            "secu1": 1,
+            "secu2": -1,
+            "secu3": -1,
+            "locp": 0,
+            "actp": "0",
+            "etatp": -1,
+        }
+    )
+    return {"characteristics": characteristics, "places": places, "users": users, "vehicles": vehicles}
+
+
+def make_bike_lanes(
+    n_lanes: int, commune_codes: np.ndarray, polygons: np.ndarray, extent: float = 50_000, seed: int = 0
+) -> gpd.GeoDataFrame:
+    """Generates bike lanes with the attributes of the bike lanes dataset: the type of lane on each side of the
+    road ("ame_d", "ame_g", one side in three without lane) and the commune of each side ("code_com_d",
+    "code_com_g"), which is the commune containing the middle of the lane.
+
+    Args:
+        n_lanes (int): number of lanes
+        commune_codes (np.ndarray): INSEE codes of the communes, see `make_communes`
+        polygons (np.ndarray): polygons of the communes
+        extent (float, optional): size of the side of the region, in metres. Defaults to 50 km.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        gpd.GeoDataFrame: the lanes, in EPSG:2154
+    """
+    rng = np.random.default_rng(seed)
+    lanes = make_lines(n_lanes, extent, mean_length=300, seed=seed)
+    middles = shapely.line_interpolate_point(lanes, 0.5, normalized=True)
+    _, nearest = STRtree(polygons).query_nearest(middles, all_matches=False)
+    communes = np.asarray(commune_codes, dtype=object)[nearest]
+    lane_types = np.array(LANE_TYPES + ["AUCUN"] * (len(LANE_TYPES) // 2), dtype=object)
+    return gpd.GeoDataFrame(
+        {
+            "ame_d": rng.choice(lane_types, n_lanes),
+            "ame_g": rng.choice(lane_types, n_lanes),
+            "code_com_d": communes,
+            "code_com_g": communes,
+        },
+        geometry=lanes,
+        crs="EPSG:2154",
+    )
+
+
+def make_training_data(n_communes: int, seed: int = 0) -> pd.DataFrame:
+    """Generates a training matrix with the columns of `get_training_data`: the number of accidents grows with
+    the population and the length of the bike lanes of the commune.
+
+    Args:
+        n_communes (int): number of communes
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: one row per commune
+    """
+    rng = np.random.default_rng(seed)
+    population = np.round(rng.lognormal(6.5, 1.5, n_communes)).astype(int)
+    # Most of the communes have no lane of a given type
+    lane_lengths = rng.exponential(2_000, (n_communes, len(LANE_TYPES))) * (rng.random((n_communes, 1)) < 0.3)
+    lane_lengths *= rng.random((n_communes, len(LANE_TYPES))) < 0.2
+    df = pd.DataFrame(
+        {
+            "population": population,
+            "code_commune": [f"{1 + i // 1000:02d}{i % 1000:03d}" for i in range(n_communes)],
+            "lat": rng.uniform(6_100_000, 7_100_000, n_communes),
+            "long": rng.uniform(100_000, 1_200_000, n_communes),
+            "area": rng.lognormal(7, 0.8, n_communes),
+            "accident_num": rng.poisson(population / 5_000 + lane_lengths.sum(axis=1) / 20_000).astype(float),
+            "length": lane_lengths.sum(axis=1),
+            "road length": rng.lognormal(10, 1, n_communes),
+        }
+    )
+    return pd.concat([df, pd.DataFrame(lane_lengths, columns=LANE_TYPES)], axis=1)
+
+
+def write_vector_file(
+    path: str,
+    geometries: np.ndarray,
+    attributes: dict[str, np.ndarray] | None = None,
+    crs: str = "EPSG:2154",
+    file_crs: str | None = None,
+) -> str:
+    """Saves generated geometries in a vector file, for the functions reading the datasets from disk.
+
+    Args:
+        path (str): destination file, its extension tells the format (".geojson", ".shp"...)
+        geometries (np.ndarray): shapely geometries
+        attributes (dict[str, np.ndarray], optional): attributes of the geometries. Defaults to None.
+        crs (str, optional): coordinate reference system of the geometries. Defaults to "EPSG:2154".
+        file_crs (str, optional): coordinate reference system of the file. Defaults to None, meaning `crs`.
+
+    Returns:
+        str: the path of the file
+    """
+    gdf = gpd.GeoDataFrame(attributes or {}, geometry=geometries, crs=crs)
+    if file_crs is not None:
+        gdf = gdf.to_crs(file_crs)
+    gdf.to_file(path)
+    return path
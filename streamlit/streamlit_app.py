@@ -7,6 +7,7 @@ import pandas as pd
 import plotly.express as px
 
 import streamlit as st
+from velosafe.data.feature_store import TRAINING_DATA_SCHEMA, compact_features
 from velosafe.models import load_model
 
 st.set_page_config(page_title="Accidentologie des vélos en France", page_icon="🔥")
@@ -246,12 +247,15 @@ def simulation_page():
     # Load model
     model = load_model("./streamlit/resources/model.pkl")
     # Load train data
-    train_data = pd.read_csv("./streamlit/resources/training_data.csv")
+    train_data = pd.read_csv("./streamlit/resources/training_data.csv", index_col=0, dtype={"code_commune": str})
+    # INSEE codes are compared as 5 characters strings, e.g. "01001"
+    train_data["code_commune"] = train_data["code_commune"].str.zfill(5)
+    train_data = compact_features(train_data, TRAINING_DATA_SCHEMA)
     code_comm = st.text_input("Code commune")
     km_bikelane = st.text_input("Kilomètres de pistes cyclables à construire")
     if st.button("Valider"):
         if code_comm and km_bikelane:
-            x_test = train_data[train_data["code_commune"] == code_comm]
+            x_test = train_data[train_data["code_commune"] == code_comm.strip().zfill(5)]
             x_test = x_test[FEATURES]
             nb_accidents_before = x_test["accident_num"]
             if x_test.shape[0] > 0:
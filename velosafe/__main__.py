@@ -1,6 +1,20 @@
+import os
+from datetime import datetime
+
 import click
 
-from velosafe.data import Datasets, get_training_data
+# Only the light modules are imported here: the commands import the geo stack (geopandas, fiona, shapely, pyproj)
+# when they need it, so that `download` or `--help` start immediately. See benchmarks/bench_import_time.py.
+from velosafe.data import Datasets
+from velosafe.data.datasets import DEPARTMENT_CODES
+from velosafe.data.download import MIRROR_ENV_VAR, download_all
+
+mirror_option = click.option(
+    "--mirror",
+    envvar=MIRROR_ENV_VAR,
+    help="Base URL or local folder of a mirror of the datasets, to download from instead of their sites. "
+    f"Defaults to ${MIRROR_ENV_VAR}.",
+)
 
 
 @click.group()
@@ -8,6 +22,22 @@ def cli():
     pass
 
 
+def check_departments(ctx: click.Context, param: click.Parameter, departments: tuple[str, ...]) -> tuple[str, ...]:
+    departments = tuple(department.upper() for department in departments)
+    unknown = [department for department in departments if department not in DEPARTMENT_CODES]
+    if unknown:
+        raise click.BadParameter(
+            f"unknown département {', '.join(unknown)}, expected a code such as 01, 75, 2A or 971."
+        )
+    return departments
+
+
+def use_mirror(mirror: str | None) -> None:
+    # Set in the environment, so that the processes computing the features download from the mirror too
+    if mirror:
+        os.environ[MIRROR_ENV_VAR] = mirror
+
+
 @cli.command()
 @click.argument(
     "dataset",
@@ -15,7 +45,10 @@ def cli():
     required=True,
 )
 @click.argument("path", type=click.Path(), required=False, default="./data")
-def download(dataset, path):
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=4, help="Number of simultaneous downloads.")
+@mirror_option
+def download(dataset, path, jobs, mirror):
+    use_mirror(mirror)
     if dataset == "accidents":
         datasets = [
             Datasets.ACCIDENTS_VEHICULES,
@@ -24,20 +57,94 @@ def download(dataset, path):
             Datasets.ACCIDENTS_CHARACTERISTICS,
         ]
     elif dataset == "all":
-        datasets = (v for k, v in vars(Datasets).items() if not k.startswith("__"))
+        datasets = [v for k, v in vars(Datasets).items() if not k.startswith("__")]
     else:
         datasets = [getattr(Datasets, dataset)]
 
-    for dataset in datasets:
-        click.echo(f"Downloading {dataset.filename}.")
-        dataset.download(path)
+    click.echo(f"Downloading {', '.join(str(dataset.filename) for dataset in datasets)}.")
+    download_all(datasets, path, max_workers=jobs)
+    click.echo("All done 🎉")
+
+
+@cli.command()
+@click.argument("path", type=click.Path(), required=False, default="./data")
+@click.option("--force", is_flag=True, help="Rebuild every stage, even the up-to-date ones.")
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, help="Number of stages run concurrently.")
+@click.option(
+    "--dep",
+    "departments",
+    multiple=True,
+    callback=check_departments,
+    help="Build only the communes of this département, e.g. 75 or 2A. Repeat it for several départements.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Record the time, memory and row counts of each stage in a JSON report, in the profiles subfolder.",
+)
+@click.option(
+    "--lane-attribution",
+    "attribution",
+    # LANE_ATTRIBUTIONS of build_features, which is not imported by --help
+    type=click.Choice(["attributes", "spatial"]),
+    default="attributes",
+    show_default=True,
+    help="Attribute the bike lanes to the communes of their commune codes, or to the communes they cross.",
+)
+@mirror_option
+def datagen(path, force, jobs, departments, profile, attribution, mirror):
+    from velosafe.data.build_features import get_assignment_report, get_stages_status, get_training_data
+    from velosafe.data.feature_store import memory_report
+    from velosafe.data.profiling import collect_profiles, enable_profiling, write_profile_report
+
+    use_mirror(mirror)
+    departments = list(departments) or None
+    if profile:
+        enable_profiling()
+    if not force:
+        for stage, is_fresh in get_stages_status(path, departments, attribution).items():
+            click.echo(f"Skipping {stage}: up to date." if is_fresh else f"Building {stage}.")
+    training_data = get_training_data(
+        data_folder=path, departments=departments, force=force, jobs=jobs, attribution=attribution
+    )
+    size = memory_report(training_data)["bytes"].sum()
+    click.echo(f"Training matrix: {len(training_data)} communes, {size / 2**20:.1f} MiB in memory.")
+    report = get_assignment_report(path, departments=departments)
+    if report:
+        click.echo(f"Accidents located in the communes: {report}.")
+    if profile:
+        profiles = collect_profiles()
+        for stage in profiles:
+            label = f"{stage.name}[{stage.department}]" if stage.department else stage.name
+            click.echo(
+                f"{label:<32} {stage.wall_time:>8.2f}s wall {stage.cpu_time:>8.2f}s CPU "
+                f"{stage.peak_rss / 2**20:>8.0f} MiB peak, {stage.rows_in} -> {stage.rows_out} rows"
+            )
+        profile_path = os.path.join(path, "profiles", f"datagen-{datetime.now():%Y%m%d-%H%M%S}.json")
+        command = {"force": force, "jobs": jobs, "departments": departments, "lane_attribution": attribution}
+        write_profile_report(profiles, profile_path, command)
+        click.echo(f"Profile saved to {profile_path}.")
     click.echo("All done 🎉")
 
 
 @cli.command()
 @click.argument("path", type=click.Path(), required=False, default="./data")
-def datagen(path):
-    get_training_data(data_folder=path)
+@click.option(
+    "--year",
+    "years",
+    type=int,
+    multiple=True,
+    help="Year of a BAAC release to count, repeat it for several years. Defaults to 2005 to 2021.",
+)
+@click.option("--force", is_flag=True, help="Recount every year, even the ones already saved.")
+def accidents(path, years, force):
+    from velosafe.data.accidents_history import BAAC_YEARS
+    from velosafe.data.build_features import get_accidents_by_year, get_years_to_count
+
+    years = list(years) or list(BAAC_YEARS)
+    new_years = get_years_to_count(path, years, force)
+    click.echo(f"Counting the accidents of {', '.join(map(str, new_years))}." if new_years else "Up to date.")
+    get_accidents_by_year(data_folder=path, years=years, force=force)
     click.echo("All done 🎉")
 
 
@@ -1,4 +1,20 @@
-__all__ = ["Datasets", "RemoteFile", "get_training_data"]
-from .build_features import get_training_data
+import importlib
+from typing import TYPE_CHECKING
+
 from .datasets import Datasets
 from .download import RemoteFile
+
+__all__ = ["Datasets", "RemoteFile", "get_accidents_by_year", "get_training_data"]
+
+# The features are built with the geo stack (geopandas, fiona, shapely, pyproj), which takes seconds to import:
+# the modules building them are only imported when one of their functions is first accessed
+_LAZY_EXPORTS = {"get_accidents_by_year": ".build_features", "get_training_data": ".build_features"}
+
+if TYPE_CHECKING:
+    from .build_features import get_accidents_by_year, get_training_data
+
+
+def __getattr__(name: str):
+    if name in _LAZY_EXPORTS:
+        return getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,229 @@
+import os
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from velosafe.data.accidents_preprocessing import ACCIDENTS_COLUMNS, preprocess_accidents_dfs
+from velosafe.data.commune_assignment import COORDINATE_COLUMNS, parse_coordinates
+from velosafe.data.datasets import Datasets
+from velosafe.data.download import ChecksumManifest
+
+# Years of the BAAC releases published on data.gouv.fr with per-commune locations
+BAAC_YEARS = range(2005, 2022)
+# Number of rows read at once: the users table of a year has up to 200k rows
+CHUNK_SIZE = 50_000
+
+# Name of the file of each table on data.gouv.fr, the separator changed from "_" to "-" in 2019
+_TABLE_NAMES = {"characteristics": "caracteristiques", "places": "lieux", "users": "usagers", "vehicles": "vehicules"}
+# Name under which `Datasets` downloads the files of the last release
+_DOWNLOADED_FILES = {
+    2021: {
+        "characteristics": Datasets.ACCIDENTS_CHARACTERISTICS.filename,
+        "places": Datasets.ACCIDENTS_PLACES.filename,
+        "users": Datasets.ACCIDENTS_USERS.filename,
+        "vehicles": Datasets.ACCIDENTS_VEHICULES.filename,
+    }
+}
+_DTYPES = {"Num_Acc": "int64", "catv": "Int8", "com": str, "dep": str, "lat": str, "long": str}
+# Columns renamed in the characteristics files since the 2022 release
+_RENAMED_CHARACTERISTICS = {"Num_Acc": "Accident_Id"}
+
+
+def baac_path(data_folder: str, table: str, year: int) -> str:
+    """Finds the file of a table of the BAAC release of a year. The files keep the name they have on
+    data.gouv.fr ("caracteristiques_2018.csv", "lieux-2019.csv"...), except the 2021 ones downloaded by `Datasets`.
+
+    Args:
+        data_folder (str): folder containing the files
+        table (str): "characteristics", "places", "users" or "vehicles"
+        year (int): year of the release
+
+    Raises:
+        FileNotFoundError: none of the possible names of the file exists in the data folder
+
+    Returns:
+        str: path of the file
+    """
+    candidates = [f"{_TABLE_NAMES[table]}{separator}{year}.csv" for separator in ("-", "_")]
+    if table in _DOWNLOADED_FILES.get(year, {}):
+        candidates.insert(0, _DOWNLOADED_FILES[year][table])
+    for filename in candidates:
+        path = os.path.join(data_folder, filename)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {table} file for {year} in {data_folder}, expected one of {candidates}")
+
+
+def baac_checksums(data_folder: str, year: int) -> dict[str, str]:
+    """Computes the md5 checksums of the files of the BAAC release of a year, see `baac_path`. They are kept in
+    the checksum manifest of the data folder, so a file is only read again if it changed.
+
+    Args:
+        data_folder (str): folder containing the files
+        year (int): year of the release
+
+    Returns:
+        dict[str, str]: the checksum of each file of the release found in the data folder, by file name
+    """
+    manifest = ChecksumManifest(data_folder)
+    checksums = {}
+    for table in _TABLE_NAMES:
+        try:
+            path = Path(baac_path(data_folder, table, year))
+        except FileNotFoundError:
+            continue
+        checksums[path.name] = manifest.checksum(path)
+    return checksums
+
+
+def iter_baac_chunks(
+    data_folder: str, table: str, year: int, columns: list[str], chunksize: int = CHUNK_SIZE
+) -> Iterator[pd.DataFrame]:
+    """Reads some columns of a BAAC table by chunks, with compact dtypes.
+    Handles the formats of the different releases: files before 2019 are encoded in latin-1 and separated by
+    commas (tabs in 2009), the more recent ones are encoded in utf-8 and separated by semicolons.
+    Since 2022 the accident number of the characteristics table is named "Accident_Id", it is renamed "Num_Acc".
+
+    Args:
+        data_folder (str): folder containing the files, see `baac_path`
+        table (str): "characteristics", "places", "users" or "vehicles"
+        year (int): year of the release
+        columns (list[str]): columns to read
+        chunksize (int, optional): number of rows per chunk. Defaults to CHUNK_SIZE.
+
+    Yields:
+        pd.DataFrame: the next rows of the table
+    """
+    path = baac_path(data_folder, table, year)
+    encoding = "utf-8" if year >= 2019 else "latin-1"
+    with open(path, encoding=encoding) as f:
+        header = f.readline()
+    separator = max([";", ",", "\t"], key=header.count)
+    renamed = _RENAMED_CHARACTERISTICS if table == "characteristics" and year >= 2022 else {}
+    chunks = pd.read_csv(
+        path,
+        sep=separator,
+        encoding=encoding,
+        usecols=[renamed.get(column, column) for column in columns],
+        dtype={renamed.get(column, column): _DTYPES[column] for column in columns},
+        chunksize=chunksize,
+    )
+    with chunks:
+        for chunk in chunks:
+            yield chunk.rename(columns={name: column for column, name in renamed.items()})
+
+
+def commune_codes(df_characteristics: pd.DataFrame, year: int) -> pd.Series:
+    """Returns the INSEE code of the commune of the accidents.
+    Since 2019 the "com" column holds the code. Before, it only holds the 3 last characters of the code and the
+    "dep" column the département on 3 characters: "750" for Paris, "201" and "202" for Corsica, "971" for
+    Guadeloupe. The code of the département is then made of the 2 first characters of "dep", apart from
+    Corsica whose communes are numbered "2A..." and "2B...".
+
+    Args:
+        df_characteristics (pd.DataFrame): the "com" column, and the "dep" column before 2019
+        year (int): year of the release
+
+    Returns:
+        pd.Series: the INSEE codes, as 5 characters strings
+    """
+    if year >= 2019:
+        return df_characteristics["com"].str.zfill(5)
+    department = df_characteristics["dep"].str.zfill(3).replace({"201": "2A", "202": "2B"}).str[:2]
+    return department + df_characteristics["com"].str.zfill(3)
+
+
+def accident_coordinates(values: pd.Series, year: int) -> np.ndarray:
+    """Converts the latitudes or longitudes of a BAAC characteristics table to degrees.
+    Since 2019 they are written with a decimal comma ("48,8566"). Before, they are integers in hundred
+    thousandths of a degree ("4885660"), 0 when the location is unknown.
+
+    Args:
+        values (pd.Series): the "lat" or "long" column, as strings
+        year (int): year of the release
+
+    Returns:
+        np.ndarray: the coordinates in degrees, NaN where they are missing or invalid
+    """
+    coordinates = parse_coordinates(values)
+    if year < 2019:
+        # Some releases already use decimals, only the integers are scaled
+        is_integer = ~values.astype("string").str.contains("[.,]", regex=True).fillna(False).to_numpy(dtype=bool)
+        coordinates[is_integer] /= 100_000
+        coordinates[is_integer & (coordinates == 0)] = np.nan
+    return coordinates
+
+
+def read_bike_accidents(
+    data_folder: str, year: int, chunksize: int = CHUNK_SIZE, coordinates: bool = False
+) -> pd.DataFrame:
+    """Reads the accidents of a year that involved a bike, see `preprocess_accidents_dfs`.
+    The tables are read by chunks and each chunk is reduced to the bike accidents before the next one is read,
+    so only these accidents are held in memory.
+
+    Args:
+        data_folder (str): folder containing the files, see `baac_path`
+        year (int): year of the release
+        chunksize (int, optional): number of rows read at once. Defaults to CHUNK_SIZE.
+        coordinates (bool, optional): also read the location of the accidents, see `accident_coordinates`.
+            Defaults to False.
+
+    Returns:
+        pd.DataFrame: the number ("Num_Acc") and the INSEE code of the commune ("com") of the accidents, and
+        their WGS84 "lat" and "long" in degrees if `coordinates` is set
+    """
+
+    def read(table: str, columns: list[str], select) -> pd.DataFrame:
+        chunks = [select(chunk) for chunk in iter_baac_chunks(data_folder, table, year, columns, chunksize)]
+        return pd.concat(chunks, ignore_index=True)
+
+    df_vehicles = read("vehicles", ACCIDENTS_COLUMNS["vehicles"], lambda chunk: chunk[chunk["catv"] == 1])
+    bike_accidents = df_vehicles["Num_Acc"].unique()
+
+    def is_bike_accident(chunk: pd.DataFrame) -> pd.DataFrame:
+        return chunk[chunk["Num_Acc"].isin(bike_accidents)]
+
+    df_places = read("places", ACCIDENTS_COLUMNS["places"], is_bike_accident)
+    df_users = read("users", ACCIDENTS_COLUMNS["users"], lambda chunk: is_bike_accident(chunk).drop_duplicates())
+    characteristics_columns = ACCIDENTS_COLUMNS["characteristics"] + ([] if year >= 2019 else ["dep"])
+    if coordinates:
+        characteristics_columns = characteristics_columns + COORDINATE_COLUMNS
+    df_characteristics = read("characteristics", characteristics_columns, is_bike_accident)
+    df_accidents = preprocess_accidents_dfs(
+        pd.DataFrame({"Num_Acc": df_characteristics["Num_Acc"], "com": commune_codes(df_characteristics, year)}),
+        df_places,
+        df_users,
+        df_vehicles,
+    )
+    if coordinates:
+        locations = df_characteristics[["Num_Acc"]].assign(
+            **{column: accident_coordinates(df_characteristics[column], year) for column in COORDINATE_COLUMNS}
+        )
+        df_accidents = df_accidents.merge(locations.drop_duplicates("Num_Acc"), on="Num_Acc")
+    return df_accidents
+
+
+def build_accidents_by_year(
+    data_folder: str, years: Iterable[int] = BAAC_YEARS, chunksize: int = CHUNK_SIZE
+) -> pd.DataFrame:
+    """Counts the bike accidents per commune and per year.
+
+    Args:
+        data_folder (str): folder containing the BAAC files of the years, see `baac_path`
+        years (Iterable[int], optional): years to count. Defaults to BAAC_YEARS.
+        chunksize (int, optional): number of rows read at once. Defaults to CHUNK_SIZE.
+
+    Returns:
+        pd.DataFrame: one row per commune and year with at least one accident, with the columns
+        "code_commune", "year" and "accident_num"
+    """
+    counts = []
+    for year in years:
+        accidents = read_bike_accidents(data_folder, year, chunksize)
+        count = accidents.groupby("com").size().reset_index(name="accident_num").rename(columns={"com": "code_commune"})
+        counts.append(count.assign(year=year)[["code_commune", "year", "accident_num"]])
+    if not counts:
+        return pd.DataFrame({"code_commune": [], "year": [], "accident_num": []})
+    return pd.concat(counts, ignore_index=True).astype({"year": "int16", "accident_num": "int32"})
@@ -1,5 +1,13 @@
 import pandas as pd
 
+# Columns of each BAAC table used by `preprocess_accidents_dfs`, to be passed as `usecols` when reading the files
+ACCIDENTS_COLUMNS = {
+    "characteristics": ["Num_Acc", "com"],
+    "places": ["Num_Acc"],
+    "users": ["Num_Acc"],
+    "vehicles": ["Num_Acc", "catv"],
+}
+
 
 def build_accidents_features(
     df_characteristics: pd.DataFrame,
@@ -10,10 +18,7 @@ def build_accidents_features(
     accidents_df = preprocess_accidents_dfs(df_characteristics, df_places, df_users, df_vehicles)
 
     accident_features = (
-        accidents_df.groupby("com")
-        .count()
-        .reset_index()
-        .rename(columns={"com": "code_commune", "Num_Acc": "accident_num"})
+        accidents_df.groupby("com").size().reset_index(name="accident_num").rename(columns={"com": "code_commune"})
     )
 
     return accident_features
@@ -25,42 +30,30 @@ def preprocess_accidents_dfs(
     df_users: pd.DataFrame,
     df_vehicles: pd.DataFrame,
 ) -> pd.DataFrame:
-
-    # Keep only accidents involving bikes, meaning catv = vehicle category == 1
-    df_vehicle_bike = df_vehicles[df_vehicles.catv == 1]
-
+    """Selects the accidents involving a bike. Every table is first reduced to these accidents, so the joins
+    only handle a few thousand rows, and the dataframes given as arguments are left untouched.
+    Only the columns listed in `ACCIDENTS_COLUMNS` are used.
+
+    Args:
+        df_characteristics (pd.DataFrame): characteristics of the accidents
+        df_places (pd.DataFrame): places of the accidents
+        df_users (pd.DataFrame): users involved in the accidents
+        df_vehicles (pd.DataFrame): vehicles involved in the accidents
+
+    Returns:
+        pd.DataFrame: the number ("Num_Acc") and the commune ("com") of the accidents
+    """
+    # Keep only accidents involving bikes, meaning catv = vehicle category == 1.
     # In case of bike-on-bike accident, we keep only one line in the dataset
-    df_vehicle_bike.drop_duplicates(subset="Num_Acc", inplace=True, keep="first")
-
-    df_vehicle_bike.reset_index()
-    df_vehicle_bike.drop("occutc", axis=1, inplace=True)  # drop a column of nans
-
-    # Drop useless columns
-    df_vehicle_bike.drop(["id_vehicule", "num_veh", "senc", "choc"], axis=1, inplace=True)
-    df_places = df_places.drop(["voie", "v1", "v2", "vosp", "pr", "pr1", "lartpc"], axis=1)
-    df_characteristics.drop(["jour", "mois", "an", "dep", "col", "adr", "lat", "long"], axis=1, inplace=True)
-    df_users.drop(["id_vehicule", "num_veh", "place", "trajet"], axis=1, inplace=True)
-
-    # Create a column indicating whether the accident happenned on a cyclable lane or not
-    df_places["piste_cyclable"] = 0
-    for i in range(len(df_places)):
-        if df_places.situ[i] == 5:
-            df_places.piste_cyclable[i] = 1
-
-    # We merge on the number of accident taking on the left the
-    # dataset on which we kept only the accidents that involved bikes
-    accidents_df = df_vehicle_bike.merge(df_places, on="Num_Acc")
-
-    # We merge the carac dataset on the two previous ones on Num_Acc
-    accidents_df = accidents_df.merge(df_characteristics, on="Num_Acc")
+    bike_accidents = df_vehicles.loc[df_vehicles["catv"] == 1, "Num_Acc"].drop_duplicates()
 
-    # Remove duplicates accidents
-    df_users.drop_duplicates(subset="Num_Acc", keep="first", inplace=True)
+    # Accidents without any user are discarded, whatever their number of users
+    bike_accidents = bike_accidents[bike_accidents.isin(df_users["Num_Acc"])]
 
-    # Merging users
-    accidents_df = accidents_df.merge(df_users, on="Num_Acc")
+    places = df_places.loc[df_places["Num_Acc"].isin(bike_accidents), ["Num_Acc"]]
+    characteristics = df_characteristics.loc[df_characteristics["Num_Acc"].isin(bike_accidents), ["Num_Acc", "com"]]
 
-    # Keeping only data useful for training
-    accidents_df = accidents_df[["Num_Acc", "com"]]
+    # Joining the reduced tables keeps one line per place and characteristics of each accident
+    accidents_df = bike_accidents.to_frame().merge(places, on="Num_Acc").merge(characteristics, on="Num_Acc")
 
-    return accidents_df
+    return accidents_df.reset_index(drop=True)
@@ -0,0 +1,28 @@
+import os
+import uuid
+from contextlib import contextmanager
+from typing import Iterator
+
+
+@contextmanager
+def atomic_path(path: str) -> Iterator[str]:
+    """Yields a temporary path to write to, which is renamed to `path` once the block succeeds.
+    Readers therefore see either the previous file or the complete new one, never a partially written file,
+    even if the writer is interrupted or several processes write the same file.
+    The directory of the file is created if needed.
+
+    Args:
+        path (str): final path of the file
+
+    Yields:
+        str: temporary path, in the same directory as `path`
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -1,145 +1,255 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
+from shapely import STRtree
+
+from velosafe.data.feature_store import department_code, normalize_commune_codes
+from velosafe.data.overlay import pair_intersection_lengths
+from velosafe.data.projection import project_geometries
+
+# Attributes of the bike lanes dataset used to compute the features
+BIKE_LANE_COLUMNS = ["ame_d", "ame_g", "code_com_d", "code_com_g"]
 
 
-def build_bike_lanes_features(df_bike_lanes: gpd.GeoDataFrame, epsg: int = 27561) -> pd.DataFrame:
+def build_bike_lanes_features(
+    df_bike_lanes: gpd.GeoDataFrame | pd.DataFrame,
+    epsg: int = 27561,
+    df_communes: gpd.GeoDataFrame | None = None,
+    n_jobs: int | None = None,
+) -> pd.DataFrame:
     """Computes a dataframe containing some useful characteristics of the bike lanes in each french commune
 
+    The lanes are attributed to communes with their "code_com_d" and "code_com_g" attributes. If the shapes of the
+    communes are given, the lanes are instead attributed by intersecting their geometry with the communes,
+    see `attribute_lanes_to_communes`.
+
     Args:
-        df_bike_lanes (gpd.GeoDataFrame): geopandas dataframe from geojson containing all french bike lanes
-        epsg (int, optional): EPSG code specifying output projection. Defaults to 27561.
+        df_bike_lanes (gpd.GeoDataFrame | pd.DataFrame): geopandas dataframe from geojson containing all french
+            bike lanes, or their attributes with their already measured "length"
+        epsg (int, optional): EPSG code specifying output projection, if the lanes are not measured yet.
+            Defaults to 27561.
+        df_communes (gpd.GeoDataFrame, optional): shape of the communes, to attribute the lanes spatially.
+            Defaults to None.
+        n_jobs (int, optional): number of départements intersected at once when attributing the lanes spatially.
+            Defaults to None, meaning the number of CPUs.
 
     Returns:
         pd.DataFrame: dataframe containing features about the bike lanes
     """
-    # Project to planar coordinate system
-    df_bike_lanes["length"] = df_bike_lanes["geometry"].to_crs(epsg=epsg).length
+    if df_communes is not None:
+        df_bike_lanes = attribute_lanes_to_communes(df_bike_lanes, df_communes, epsg, n_jobs)
+    elif "length" not in df_bike_lanes.columns:
+        # Project to planar coordinate system
+        df_bike_lanes["length"] = df_bike_lanes["geometry"].to_crs(epsg=epsg).length
 
-    bike_lane_length = get_length_by_communes(df_bike_lanes)
-    bike_lane_length_per_type = get_length_by_communes_and_by_type(df_bike_lanes)
+    return get_length_by_communes_and_by_type(df_bike_lanes)
 
-    features = pd.merge(bike_lane_length, bike_lane_length_per_type, how="outer", on="insee_com")
 
-    return features
+def get_length_by_communes_and_by_type(df_bike_lanes: pd.DataFrame) -> pd.DataFrame:
+    """Computes the total length of the bike lanes in a commune, and the length for each type of bike lanes,
+    in a single pass over the lanes.
+    Both sides of the road are stacked into one long (commune, type, length) table encoded as categorical codes,
+    and the lengths are summed for every (commune, type) cell at once with `np.bincount`.
 
+    Args:
+        df_bike_lanes (pd.DataFrame): bike lanes with the "ame_d", "ame_g", "code_com_d", "code_com_g"
+            and "length" columns
 
-def get_length_by_communes(df_bike_lanes: gpd.GeoDataFrame) -> pd.DataFrame:
-    """Computes the total length of the bike lanes in a commune
+    Returns:
+        pd.DataFrame: has a "insee_com" column contaning the id of the commune, a "length" column containing
+        the total length of bike lanes, and the other columns are named after the existing type of bike lanes
+        (in "ame_d" and "ame_g" of the df_bike_lanes columns), and contain the total length of this type of
+        bike lane in each commune
+    """
+    # Long table: the left side of every lane, followed by its right side
+    communes = pd.Categorical(np.concatenate([df_bike_lanes["code_com_g"], df_bike_lanes["code_com_d"]]))
+    lane_types = pd.Categorical(np.concatenate([df_bike_lanes["ame_g"], df_bike_lanes["ame_d"]]))
+    lengths = np.tile(df_bike_lanes["length"].to_numpy(dtype=float), 2)
+
+    # Remove the sides without a bike lane and those outside of a known commune
+    is_lane = (lane_types != "AUCUN") & (communes.codes >= 0)
+    # The codes are as small as int8: widen them before combining them into a single index
+    commune_codes, type_codes = communes.codes[is_lane].astype(np.int64), lane_types.codes[is_lane].astype(np.int64)
+    lengths = lengths[is_lane]
+
+    n_communes, n_types = len(communes.categories), len(lane_types.categories)
+    total_length = np.bincount(commune_codes, weights=lengths, minlength=n_communes)
+    # Sides with an unknown type count in the total length only
+    has_type = type_codes >= 0
+    length_per_type = np.bincount(
+        commune_codes[has_type] * n_types + type_codes[has_type],
+        weights=lengths[has_type],
+        minlength=n_communes * n_types,
+    ).reshape(n_communes, n_types)
+
+    features = pd.DataFrame(length_per_type, columns=lane_types.categories)
+    features.insert(0, "length", total_length)
+    features.insert(0, "insee_com", communes.categories)
+    # Keep only the communes with at least one bike lane, and the types that exist
+    features = features[np.bincount(commune_codes, minlength=n_communes) > 0].reset_index(drop=True)
+    return features.drop(columns="AUCUN", errors="ignore")
+
+
+def nearest_lane_distances(points: np.ndarray, lanes: np.ndarray, max_distance: float | None = None) -> np.ndarray:
+    """Computes the distance from each point to the nearest lane, querying a STRtree of the lanes with all
+    the points at once. Points and lanes must be in the same projected coordinate system.
 
     Args:
-        df_bike_lanes (gpd.GeoDataFrame): geopandas dataframe from geojson containing all french bike lanes
+        points (np.ndarray): shapely points, None where the location is unknown
+        lanes (np.ndarray): shapely geometries of the lanes
+        max_distance (float, optional): lanes further than this distance are ignored, which speeds up the
+            search. Defaults to None, meaning no limit.
 
     Returns:
-        pd.DataFrame: has a "insee_com" column contaning the id of the commune, the other columns are named
-        after the existing type of bike lanes (in "ame_d" and "ame_g" of the df_bike_lanes columns), and contain
-        the total length of this type of bike lane in each commune
+        np.ndarray: the distance to the nearest lane, NaN if there is no lane within `max_distance`
     """
-    right_not_none = df_bike_lanes[~(df_bike_lanes["ame_d"] == "AUCUN")][["code_com_d", "length"]]
-    gb_right = right_not_none.groupby("code_com_d")
-    right_lenght_by_commune = gb_right.agg("sum").reset_index()
-
-    left_not_none = df_bike_lanes[~(df_bike_lanes["ame_g"] == "AUCUN")][["code_com_g", "length"]]
-    gb_left = left_not_none.groupby("code_com_g")
-    left_lenght_by_commune = gb_left.agg("sum").reset_index()
-
-    length_by_commune = pd.merge(
-        left_lenght_by_commune,
-        right_lenght_by_commune,
-        left_on="code_com_g",
-        right_on="code_com_d",
-        suffixes=("_g", "_d"),
-        how="outer",
+    distances = np.full(len(points), np.nan)
+    if len(lanes) == 0:
+        return distances
+    (point_index, _), nearest = STRtree(lanes).query_nearest(
+        points, max_distance=max_distance, return_distance=True, all_matches=False
     )
-    length_by_commune["length_g"].fillna(0, inplace=True)
-    length_by_commune["length_d"].fillna(0, inplace=True)
-    length_by_commune["length"] = length_by_commune["length_g"] + length_by_commune["length_d"]
-
-    # replace communes id that are nan in the left column by those in the right column
-    length_by_commune.loc[length_by_commune["code_com_g"].isnull(), "code_com_g"] = length_by_commune["code_com_d"]
-    length_by_commune.rename(columns={"code_com_g": "insee_com"}, inplace=True)
+    distances[point_index] = nearest
+    return distances
 
-    length_by_commune = length_by_commune[["insee_com", "length"]]
 
-    return length_by_commune
+def get_lane_distances(
+    points: np.ndarray, lanes: np.ndarray, df_lane_types: pd.DataFrame, max_distance: float | None = None
+) -> pd.DataFrame:
+    """Computes the distance from each point to the nearest bike lane, and to the nearest lane of each type.
 
+    Args:
+        points (np.ndarray): shapely points, e.g. the location of accidents, None where it is unknown
+        lanes (np.ndarray): shapely geometries of the bike lanes, in the coordinate system of the points
+        df_lane_types (pd.DataFrame): the "ame_d" and "ame_g" types of each lane
+        max_distance (float, optional): lanes further than this distance are ignored. Defaults to None.
 
-def get_length_by_communes_and_by_type(df_bike_lanes: gpd.GeoDataFrame) -> pd.DataFrame:
-    """Computes the length of the bike lanes in a commune, for each type of bike lanes
+    Returns:
+        pd.DataFrame: one row per point, with a "distance" column and a "distance_<type>" column per type of
+        bike lane, NaN if there is no such lane within `max_distance`
+    """
+    lane_types = np.sort(pd.unique(df_lane_types[["ame_d", "ame_g"]].stack().dropna()))
+    lane_types = lane_types[lane_types != "AUCUN"]
+    is_lane = (df_lane_types["ame_d"] != "AUCUN") | (df_lane_types["ame_g"] != "AUCUN")
+
+    distances = {"distance": nearest_lane_distances(points, lanes[is_lane.to_numpy()], max_distance)}
+    for lane_type in lane_types:
+        has_type = ((df_lane_types["ame_d"] == lane_type) | (df_lane_types["ame_g"] == lane_type)).to_numpy()
+        distances[f"distance_{lane_type}"] = nearest_lane_distances(points, lanes[has_type], max_distance)
+    return pd.DataFrame(distances)
+
+
+def build_lane_distance_features(
+    communes: pd.Series,
+    points: np.ndarray,
+    lanes: np.ndarray,
+    df_lane_types: pd.DataFrame,
+    near_distance: float = 20,
+    max_distance: float | None = None,
+) -> pd.DataFrame:
+    """Computes how close to a bike lane the accidents of each commune happened, see `get_lane_distances`.
 
     Args:
-        df_bike_lanes (gpd.GeoDataFrame): geopandas dataframe from geojson containing all french bike lanes
+        communes (pd.Series): commune of each accident
+        points (np.ndarray): shapely points locating the accidents, None where the location is unknown
+        lanes (np.ndarray): shapely geometries of the bike lanes, in the projected coordinate system of the points
+        df_lane_types (pd.DataFrame): the "ame_d" and "ame_g" types of each lane
+        near_distance (float, optional): distance under which an accident is near a lane, in the unit of the
+            coordinate system. Defaults to 20.
+        max_distance (float, optional): lanes further than this distance are ignored. It must not be lower than
+            `near_distance`. Defaults to None, meaning no limit.
 
     Returns:
-        pd.DataFrame: has a "insee_com" column contaning the id of the commune, the other columns are named
-        after the existing type of bike lanes (in "ame_d" and "ame_g" of the df_bike_lanes columns), and contain
-        the total length of this type of bike lane in each commune
+        pd.DataFrame: has a "code_commune" column, an "accidents" column containing the number of located
+        accidents, a "near_lane_share" column containing the share of these accidents near a bike lane, and a
+        "near_lane_share_<type>" column per type of bike lane
     """
+    distances = get_lane_distances(points, lanes, df_lane_types, max_distance)
+    # Comparisons with NaN are False: accidents without a lane within max_distance are not near one
+    near = (distances.to_numpy() <= near_distance).astype(float)
+    shares = pd.DataFrame(near, columns=[column.replace("distance", "near_lane_share", 1) for column in distances])
 
-    # removing lines where there is no bike lanes and keeping useful columns only
-    right_not_none = df_bike_lanes[~(df_bike_lanes["ame_d"] == "AUCUN")][["code_com_d", "ame_d", "length"]]
-    # group by insee code and type of bike lanes, for the right side of the road
-    gb_right = right_not_none.groupby(["code_com_d", "ame_d"])
-    # sum the length and unstack the type of bike lane ("ame_d") so that we have a column per bike lane type
-    right_lenght_by_commune = gb_right.agg("sum").unstack(fill_value=0)
-    # flatten the multi-index columns
-    right_lenght_by_commune.columns = [col[1] for col in right_lenght_by_commune.columns.values]
-    right_lenght_by_commune.reset_index(inplace=True)
-    right_lenght_by_commune.rename(columns={"code_com_d": "insee_com"}, inplace=True)
-
-    # same thing for left side of the road
-    left_not_none = df_bike_lanes[~(df_bike_lanes["ame_g"] == "AUCUN")][["code_com_g", "ame_g", "length"]]
-    gb_left = left_not_none.groupby(["code_com_g", "ame_g"])
-    left_lenght_by_commune = gb_left.agg("sum").unstack(fill_value=0)
-    left_lenght_by_commune.columns = [col[1] for col in left_lenght_by_commune.columns.values]
-    left_lenght_by_commune.reset_index(inplace=True)
-    left_lenght_by_commune.rename(columns={"code_com_g": "insee_com"}, inplace=True)
-
-    # merging left and right while summing the values for each bike lane type (=each column)
-    length_by_commune = (
-        pd.concat([left_lenght_by_commune, right_lenght_by_commune]).groupby(["insee_com"]).sum().reset_index()
-    )
-
-    return length_by_commune
+    located = pd.notna(points)
+    shares = shares[located].assign(code_commune=np.asarray(communes)[located])
+    features = shares.groupby("code_commune").mean()
+    features.insert(0, "accidents", shares.groupby("code_commune").size())
+    return features.reset_index()
 
 
 def fast_compute_bike_lane_length_per_commune(
-    df_bike_lanes: gpd.GeoDataFrame, df_communes: gpd.GeoDataFrame, epsg: int = 27561
-) -> gpd.GeoDataFrame:
+    df_bike_lanes: gpd.GeoDataFrame, df_communes: gpd.GeoDataFrame, epsg: int = 27561, n_jobs: int | None = None
+) -> pd.DataFrame:
     """Performs the intersection between the communes geometry and the bike lanes geometry.
-    Not used anymore but could be useful for a road map not containing the id of the commune
+    Useful for a road map not containing the id of the commune, see `attribute_lanes_to_communes`.
 
     Args:
         df_bike_lanes (gpd.GeoDataFrame): geopandas dataframe from geojson containing all french bike lanes
         df_communes (gpd.GeoDataFrame): geopandas dataframe containing the shape of french communes
         epsg (int, optional): EPSG code specifying output projection. Defaults to 27561.
+        n_jobs (int, optional): number of départements processed at once. Defaults to None, meaning the number of CPUs.
 
     Returns:
-        gpd.GeoDataFrame: the communes dataframe with a new column containing the total length of bike lanes
-        in each commune
+        pd.DataFrame: has a "insee_com" column containing the id of the commune, and a "length" column containing
+        the total length of bike lanes in each commune
     """
-    ## Compute intersection
-    # Join cycling lanes to communes if they intersect
-    intersections = gpd.sjoin(df_bike_lanes, df_communes, how="inner", predicate="intersects")
+    lane_pieces = attribute_lanes_to_communes(df_bike_lanes, df_communes, epsg, n_jobs)
+    return lane_pieces.groupby("code_com_d", as_index=False)["length"].sum().rename(columns={"code_com_d": "insee_com"})
 
-    # Re-add commune geometry, lost in the sjoin
-    combined = gpd.GeoDataFrame(intersections.merge(df_communes, on="insee_com", suffixes=("_cycling", "_insee")))
 
-    # Compute line intersection between cycling lanes and communes
-    cycling_lanes_intersected = combined.geometry_cycling.intersection(combined.geometry_insee)
+def attribute_lanes_to_communes(
+    df_bike_lanes: gpd.GeoDataFrame, df_communes: gpd.GeoDataFrame, epsg: int = 27561, n_jobs: int | None = None
+) -> pd.DataFrame:
+    """Splits the bike lanes along the boundaries of the communes, for lanes without the "code_com_d" and
+    "code_com_g" attributes (e.g. OpenStreetMap extracts).
+    The lanes are indexed once in a STRtree, then each département queries it with its communes in bulk and
+    intersects the candidate pairs with vectorized shapely operations. The départements run in a thread pool.
 
-    ## Compute length
-    cycling_lanes_intersected = cycling_lanes_intersected.to_frame("lane")
-    cycling_lanes_intersected["insee_com"] = combined.insee_com
-
-    # Project to planar coordinate system
-    cycling_lanes_intersected["length"] = cycling_lanes_intersected.lane.to_crs(epsg=epsg).length
-
-    # Sum the length of the bike lanes for each commune
-    gb = cycling_lanes_intersected.groupby("insee_com")
-    cycling_lanes_length_per_commun = gb.agg("sum")
-    cycling_lanes_length_per_commun = cycling_lanes_length_per_commun.reset_index()  # index insee_com as a column
+    Args:
+        df_bike_lanes (gpd.GeoDataFrame): geopandas dataframe containing bike lanes, with optional "ame_d"
+            and "ame_g" columns giving the type of bike lane on each side
+        df_communes (gpd.GeoDataFrame): geopandas dataframe containing the "insee_com" and shape of french communes
+        epsg (int, optional): EPSG code of the projection used to intersect and measure the lanes. Defaults to 27561.
+        n_jobs (int, optional): number of départements processed at once. Defaults to None, meaning the number of CPUs.
 
-    return cycling_lanes_length_per_commun
+    Returns:
+        pd.DataFrame: one row per part of a lane inside a commune, with the columns of the measured lanes:
+        the "code_com_d" and "code_com_g" columns both contain the commune, and "length" the length of the part.
+        Without "ame_d" and "ame_g" columns, the parts have a left side of unknown type and no right side.
+    """
+    to_crs = f"EPSG:{epsg}"
+    lanes = project_geometries(np.asarray(df_bike_lanes.geometry.values), df_bike_lanes.crs.to_string(), to_crs)
+    df_communes = df_communes.drop_duplicates("insee_com")
+    communes = project_geometries(np.asarray(df_communes.geometry.values), df_communes.crs.to_string(), to_crs)
+    insee_com = normalize_commune_codes(df_communes["insee_com"]).to_numpy()
+
+    lane_tree = STRtree(lanes)
+    shapely.prepare(communes)
+    lane_lengths = shapely.length(lanes)
+
+    def attribute_department(commune_index: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        pairs = lane_tree.query(communes.take(commune_index), predicate="intersects")
+        pairs[0] = commune_index.take(pairs[0])
+        return pairs, pair_intersection_lengths(lanes, communes, pairs, lane_lengths)
+
+    departments = department_code(pd.Series(insee_com))
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        results = list(executor.map(attribute_department, departments.groupby(departments).indices.values()))
+    pairs = np.concatenate([pairs for pairs, _ in results], axis=1) if results else np.empty((2, 0), dtype=int)
+    lengths = np.concatenate([lengths for _, lengths in results]) if results else np.empty(0)
+
+    lane_types = df_bike_lanes.reindex(columns=["ame_d", "ame_g"])
+    if not {"ame_d", "ame_g"} & set(df_bike_lanes.columns):
+        # Untyped lanes are one lane of unknown type, not one on each side: without a right side, each piece
+        # counts once in the total length
+        lane_types["ame_d"] = "AUCUN"
+    lane_pieces = lane_types.iloc[pairs[1]].reset_index(drop=True)
+    lane_pieces["code_com_d"] = lane_pieces["code_com_g"] = insee_com.take(pairs[0])
+    lane_pieces["length"] = lengths
+    return lane_pieces
 
 
 if __name__ == "__main__":
@@ -1,47 +1,222 @@
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from functools import partial
+from typing import Iterable
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-
-from velosafe.data.accidents_preprocessing import build_accidents_features
-from velosafe.data.bike_lane_processing import build_bike_lanes_features
+import shapely
+
+from velosafe.data.accidents_history import BAAC_YEARS, baac_checksums, build_accidents_by_year, read_bike_accidents
+from velosafe.data.accidents_preprocessing import ACCIDENTS_COLUMNS, build_accidents_features
+from velosafe.data.bike_lane_processing import (
+    BIKE_LANE_COLUMNS,
+    build_bike_lanes_features,
+    build_lane_distance_features,
+)
+from velosafe.data.commune_assignment import COORDINATE_COLUMNS, AssignmentReport, locate_accidents
 from velosafe.data.datasets import Datasets
-from velosafe.data.download import RemoteFile, ZipRemoteFile
-from velosafe.data.road_processing import build_roads_features
-
-
-def download_all_datasets(dest_dir: str) -> None:
+from velosafe.data.download import ZipRemoteFile, download_all
+from velosafe.data.feature_store import (
+    ACCIDENT_FEATURES_SCHEMA,
+    ACCIDENTS_BY_YEAR_SCHEMA,
+    BIKE_LANE_FEATURES_SCHEMA,
+    LANE_DISTANCE_FEATURES_SCHEMA,
+    ROADS_FEATURES_SCHEMA,
+    TRAINING_DATA_SCHEMA,
+    compact_features,
+    department_code,
+    filter_features,
+    in_department,
+    normalize_commune_codes,
+    read_features,
+    read_metadata,
+    write_features,
+)
+from velosafe.data.geometry_cache import (
+    LENGTH_COLUMN,
+    PROJECTED_CRS,
+    PROJECTED_EPSG,
+    build_geometry_cache,
+    read_cached_attributes,
+    read_geometry_cache,
+)
+from velosafe.data.pipeline import Stage, plan
+from velosafe.data.profiling import (
+    StageProfile,
+    add_profiles,
+    collect_profiles,
+    enable_profiling,
+    is_profiling,
+    profile_department,
+    profile_stage,
+)
+from velosafe.data.projection import project_coordinates
+from velosafe.data.road_processing import get_road_length_by_commune
+
+# Geometries projected to PROJECTED_CRS, shared by the stages measuring lengths and distances and by all the shards
+COMMUNE_GEOMETRIES_STAGE = Stage(
+    "commune_geometries",
+    "commune_geometries.parquet",
+    inputs=[Datasets.INSEE_COM],
+    params={"crs": PROJECTED_CRS},
+    shardable=False,
+)
+LANE_GEOMETRIES_STAGE = Stage(
+    "lane_geometries",
+    "lane_geometries.parquet",
+    inputs=[Datasets.CYCLING_LANES],
+    params={"crs": PROJECTED_CRS},
+    shardable=False,
+    version="2",
+)
+ROAD_GEOMETRIES_STAGE = Stage(
+    "road_geometries",
+    "road_geometries.parquet",
+    inputs=[Datasets.ROADS],
+    params={"crs": PROJECTED_CRS},
+    shardable=False,
+)
+ACCIDENTS_STAGE = Stage(
+    "accidents",
+    "accidents_features.parquet",
+    inputs=[
+        Datasets.ACCIDENTS_CHARACTERISTICS,
+        Datasets.ACCIDENTS_PLACES,
+        Datasets.ACCIDENTS_USERS,
+        Datasets.ACCIDENTS_VEHICULES,
+        Datasets.INSEE_COM,
+    ],
+    # commune_assignment: "code" trusts the commune code of the BAAC, "coordinates" locates the accidents
+    params={"commune_assignment": "coordinates"},
+    depends_on=[COMMUNE_GEOMETRIES_STAGE],
+    version="5",
+)
+ASSIGNMENT_METADATA_KEY = "commune_assignment"
+# The releases before 2021 are not listed in Datasets: they are read from the data folder, see `baac_path`.
+# The years already counted are saved with the table, along with the checksums of their files, so that a new
+# release is appended without recounting the others, and a release whose files changed is recounted
+ACCIDENTS_BY_YEAR_STAGE = Stage(
+    "accidents_by_year",
+    "accidents_by_year.parquet",
+    inputs=[
+        Datasets.ACCIDENTS_CHARACTERISTICS,
+        Datasets.ACCIDENTS_PLACES,
+        Datasets.ACCIDENTS_USERS,
+        Datasets.ACCIDENTS_VEHICULES,
+    ],
+    version="2",
+)
+YEARS_METADATA_KEY = "years"
+CHECKSUMS_METADATA_KEY = "checksums"
+BIKE_LANES_STAGE = Stage(
+    "bike_lanes",
+    "bike_lane_features.parquet",
+    inputs=[Datasets.CYCLING_LANES, Datasets.INSEE_COM],
+    # attribution: "attributes" uses the commune codes of the lanes, "spatial" intersects them with the communes
+    params={"attribution": "attributes"},
+    depends_on=[LANE_GEOMETRIES_STAGE, COMMUNE_GEOMETRIES_STAGE],
+    version="4",
+)
+ROADS_STAGE = Stage(
+    "roads",
+    "roads_length.parquet",
+    inputs=[Datasets.INSEE_COM, Datasets.ROADS],
+    depends_on=[COMMUNE_GEOMETRIES_STAGE, ROAD_GEOMETRIES_STAGE],
+    version="3",
+)
+# Not a training feature yet: built on demand by `get_lane_distance_features`
+LANE_DISTANCES_STAGE = Stage(
+    "lane_distances",
+    "lane_distance_features.parquet",
+    inputs=[
+        Datasets.ACCIDENTS_CHARACTERISTICS,
+        Datasets.ACCIDENTS_PLACES,
+        Datasets.ACCIDENTS_USERS,
+        Datasets.ACCIDENTS_VEHICULES,
+        Datasets.CYCLING_LANES,
+        Datasets.INSEE_COM,
+    ],
+    # Distances in metres
+    params={"near_distance": 20, "max_distance": 200},
+    depends_on=[COMMUNE_GEOMETRIES_STAGE, LANE_GEOMETRIES_STAGE],
+    version="4",
+)
+TRAINING_STAGE = Stage(
+    "training",
+    "training_data.parquet",
+    inputs=[Datasets.INSEE_COM],
+    depends_on=[ACCIDENTS_STAGE, BIKE_LANES_STAGE, ROADS_STAGE],
+    version="2",
+)
+# Ways of attributing the bike lanes to the communes, see BIKE_LANES_STAGE
+LANE_ATTRIBUTIONS = ["attributes", "spatial"]
+
+
+def download_all_datasets(dest_dir: str, jobs: int = 4, keep_archives: bool = False) -> None:
     """Checks whether all the files listed in Datasets are already downloaded,
-    and downloads them if it's not the case.
+    and downloads the missing ones concurrently.
 
     Args:
         dest_dir (str): Destination directory, in which the files will be downloaded.
+        jobs (int, optional): Maximum number of simultaneous downloads. Defaults to 4.
+        keep_archives (bool, optional): Keep the archives once the files are extracted. Defaults to False.
     """
+    missing_files = []
     for attribute_name in dir(Datasets):
         if attribute_name[:2] != "__":
             remote_file = getattr(Datasets, attribute_name)
             if not remote_file.was_already_downloaded(dest_dir):
-                download_one_dataset(remote_file, dest_dir)
+                missing_files.append(remote_file)
 
+    # The md5sums are checked during the downloads, then the archives are extracted one at a time
+    download_all(missing_files, dest_dir, max_workers=jobs)
+    for remote_file in missing_files:
+        if isinstance(remote_file, ZipRemoteFile):
+            with profile_stage(f"unzip {remote_file.filename}"):
+                remote_file.unzip_7zip_file(dest_dir, keep_archive=keep_archives)
 
-def download_one_dataset(remote_file: RemoteFile | ZipRemoteFile, dest_dir: str) -> None:
-    """Downloads the given RemoteFile in the destination directory.
-    If the file is a ZipRemoteFile, the file is unzipped and only the necessary files are kept.
 
-    Args:
-        remote_file (RemoteFile | ZipRemoteFile): remote file to be downloaded
-        dest_dir (str): Destination directory, in which the files will be downloaded.
-    """
-    remote_file.download(dest_dir)
-    # TODO : check the md5sum
-    if isinstance(remote_file, ZipRemoteFile):
-        remote_file.unzip_7zip_file(dest_dir)
-        remote_file.keep_only_necessary_files(dest_dir)
+def get_stages_status(
+    data_folder: str, departments: list[str] | None = None, attribution: str = "attributes"
+) -> dict[str, bool]:
+    """Tells which stages of the pipeline will be skipped by `get_training_data` because their output is up to date.
 
+    Args:
+        data_folder (str): Parent folder contaning all the datasets.
+        departments (list[str], optional): Départements to build. Defaults to None, meaning all.
+        attribution (str, optional): Attribution of the bike lanes to the communes, one of LANE_ATTRIBUTIONS.
+            Defaults to "attributes".
 
-def get_training_data(data_folder: str = "data", filename: str = "training_data.csv") -> pd.DataFrame:
+    Returns:
+        dict[str, bool]: the label of each stage, mapped to True if it will be skipped
+    """
+    training_stage = _training_stage(attribution)
+    if departments is None or training_stage.is_fresh(data_folder):
+        return plan(training_stage, data_folder)
+    status = {}
+    for department in departments:
+        status.update(plan(training_stage.shard(department), data_folder))
+    return status
+
+
+def get_training_data(
+    data_folder: str = "data",
+    filename: str = TRAINING_STAGE.filename,
+    columns: list[str] | None = None,
+    departments: list[str] | None = None,
+    force: bool = False,
+    jobs: int = 1,
+    sparse: bool = False,
+    attribution: str = "attributes",
+) -> pd.DataFrame:
     """Returns a pandas dataframe containing all the features onto which the model will be trained.
-    Loads it if the file already exists, else computes it and saves the result.
+    Loads it if the file is up to date with its inputs, else computes it and saves the result.
+    If only some départements are requested and the file is not up to date, only these départements are computed,
+    each one being saved in its own shard, see `Stage.shard`.
     The features are currently :
     - ID, population, area, latitude and longitude of the commune
     - numbers of bike accidents in 2021 in the commune
@@ -50,25 +225,68 @@ def get_training_data(data_folder: str = "data", filename: str = "training_data.
 
     Args:
         data_folder (str, optional): Parent folder contaning all the datasets. Defaults to "data".
-        filename (str, optional): Name underwhich to save the dataframe. Defaults to "training_data.csv".
+        filename (str, optional): Name underwhich to save the dataframe. Defaults to "training_data.parquet".
+        columns (list[str], optional): Columns to load. Defaults to None, meaning all the columns.
+        departments (list[str], optional): Départements of the communes to load. Defaults to None, meaning all.
+        force (bool, optional): Recompute every stage even if its cached output is up to date. Defaults to False.
+        jobs (int, optional): Number of processes computing the features. Defaults to 1.
+        sparse (bool, optional): Store the per-type lengths of the bike lanes as sparse columns. Defaults to False.
+        attribution (str, optional): Attribution of the bike lanes to the communes, one of LANE_ATTRIBUTIONS, see
+            `get_bike_lane_features`. Defaults to "attributes".
 
     Returns:
-        pd.DataFrame: df containing all the features
+        pd.DataFrame: df containing all the features, with the compact types of TRAINING_DATA_SCHEMA
     """
-    path = os.path.join(data_folder, filename)
-    if os.path.exists(path):
-        return pd.read_csv(path, index_col=None)
+    training_stage = _training_stage(attribution)
+    path = training_stage.output_path(data_folder, filename)
+    if not force and training_stage.is_fresh(data_folder, filename):
+        training_data = read_features(path, columns=columns, departments=departments)
+    elif departments is None:
+        training_data = create_data_training(data_folder, force=force, jobs=jobs, attribution=attribution)
+        training_data = write_features(training_data, path, TRAINING_DATA_SCHEMA)
+        training_stage.mark_built(data_folder, filename)
+        training_data = filter_features(training_data, columns=columns)
     else:
-        training_data = create_data_training(data_folder)
-        training_data.to_csv(path, index=False)
-        return training_data
-
-
-def create_data_training(data_folder: str) -> pd.DataFrame:
+        shards = {department: training_stage.shard(department) for department in departments}
+        missing = [department for department, shard in shards.items() if force or not shard.is_fresh(data_folder)]
+        if missing:
+            training_data = create_data_training(
+                data_folder, force=force, jobs=jobs, departments=missing, attribution=attribution
+            )
+            for department in missing:
+                shard_path = shards[department].output_path(data_folder, filename)
+                write_features(
+                    filter_features(training_data, departments=[department]), shard_path, TRAINING_DATA_SCHEMA
+                )
+                shards[department].mark_built(data_folder, filename)
+        shards_data = [read_features(shard.output_path(data_folder, filename), columns) for shard in shards.values()]
+        training_data = pd.concat(shards_data, ignore_index=True)
+        # Each shard has the types of bike lane of its own département: a type missing from a shard, maybe built
+        # by another run, has no length in its communes
+        lane_types = [column for column in training_data if column not in TRAINING_DATA_SCHEMA.names]
+        training_data[lane_types] = training_data[lane_types].fillna(0)
+    return compact_features(training_data, TRAINING_DATA_SCHEMA, sparse=sparse)
+
+
+def create_data_training(
+    data_folder: str,
+    force: bool = False,
+    jobs: int = 1,
+    departments: list[str] | None = None,
+    attribution: str = "attributes",
+) -> pd.DataFrame:
     """Retrieves the features from the different datasets and merge them.
+    The accident, bike lane and road features are independent: with `jobs` > 1 they are computed
+    concurrently in a process pool. If départements are given, each stage is run once per département,
+    and the shards are concatenated.
 
     Args:
         data_folder (str, optional): Parent folder contaning all the datasets.
+        force (bool, optional): Recompute the features even if they are up to date. Defaults to False.
+        jobs (int, optional): Number of processes computing the features. Defaults to 1.
+        departments (list[str], optional): Départements of the communes to compute. Defaults to None, meaning all.
+        attribution (str, optional): Attribution of the bike lanes to the communes, one of LANE_ATTRIBUTIONS.
+            Defaults to "attributes".
 
     Returns:
         pd.DataFrame: df containing all the features
@@ -89,92 +307,539 @@ def create_data_training(data_folder: str) -> pd.DataFrame:
         )
         .drop_duplicates()
     )
+    df_communes["code_commune"] = normalize_commune_codes(df_communes["code_commune"])
+    if departments is not None:
+        df_communes = filter_features(df_communes, departments=departments)
+
+    # The projected geometries are shared by the stages: build them before the stages run concurrently
+    for geometries_stage in (COMMUNE_GEOMETRIES_STAGE, LANE_GEOMETRIES_STAGE, ROAD_GEOMETRIES_STAGE):
+        _build_geometries(geometries_stage, data_folder, force=force)
+
+    stages = [get_accident_features, partial(get_bike_lane_features, attribution=attribution), get_roads_features]
+    tasks = [(get_stage, department) for department in departments or [None] for get_stage in stages]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            futures = [
+                executor.submit(_run_stage, get_stage, data_folder, force, department, is_profiling())
+                for get_stage, department in tasks
+            ]
+            results = []
+            for future in futures:
+                features, profiles = future.result()
+                results.append(features)
+                add_profiles(profiles)
+    else:
+        results = []
+        for get_stage, department in tasks:
+            with profile_department(department):
+                results.append(get_stage(data_folder, force=force, department=department))
+    # The tasks are ordered by département then by stage
+    accident_features, bike_lane_features, roads_features = [
+        pd.concat(results[i :: len(stages)], ignore_index=True) for i in range(len(stages))
+    ]
+    # A type of bike lane missing from a shard has no length in its communes
+    bike_lane_features = bike_lane_features.fillna(0)
+
+    with profile_stage("final merges", rows_in=len(df_communes)) as profile:
+        df = df_communes.merge(accident_features, how="left")
+        df["accident_num"] = df["accident_num"].fillna(0)
+        df = df.merge(bike_lane_features.rename(columns={"insee_com": "code_commune"}))
+        df = df.merge(roads_features.rename(columns={"insee_com": "code_commune"}))
+        profile.rows_out = len(df)
 
-    accident_features = get_accident_features(data_folder)
-    df = df_communes.merge(accident_features, how="left")
-    df["accident_num"] = df["accident_num"].fillna(0)
-
-    bike_lane_features = get_bike_lane_features(data_folder)
-    df = df.merge(bike_lane_features.rename(columns={"insee_com": "code_commune"}))
+    return df
 
-    roads_features = get_roads_features(data_folder)
-    df = df.merge(roads_features.rename(columns={"insee_com": "code_commune"}))
 
-    return df
+def _run_stage(
+    get_stage, data_folder: str, force: bool, department: str | None, profiling: bool
+) -> tuple[pd.DataFrame, list[StageProfile]]:
+    # Runs a stage in a worker process, and sends the profiles of its steps back to the main process
+    if profiling:
+        enable_profiling()
+    with profile_department(department):
+        features = get_stage(data_folder, force=force, department=department)
+    return features, collect_profiles()
 
 
-def get_accident_features(data_folder: str, filename: str = "accidents_features.csv") -> pd.DataFrame:
+def get_accident_features(
+    data_folder: str, filename: str = ACCIDENTS_STAGE.filename, force: bool = False, department: str | None = None
+) -> pd.DataFrame:
     """Returns a panda dataframe containing the feature about the accidents, i.e. the number of
     accidents per commune in 2021.
-    Loads it if the file already exists, else computes it and saves the result.
+    Loads it if the file is up to date with its inputs, else computes it and saves the result.
 
     Args:
         data_folder (str, optional): Parent folder contaning all the datasets.
-        filename (str, optional): Name underwhich to save the dataframe. Defaults to "accidents_features.csv".
+        filename (str, optional): Name underwhich to save the dataframe. Defaults to "accidents_features.parquet".
+        force (bool, optional): Recompute the features even if they are up to date. Defaults to False.
+        department (str, optional): Compute only the communes of this département. Defaults to None, meaning all.
 
     Returns:
         pd.DataFrame: df containing the accident feature
     """
-    path = os.path.join(data_folder, filename)
-    if os.path.exists(path):
-        return pd.read_csv(path, index_col=None)
+    stage = ACCIDENTS_STAGE.shard(department) if department else ACCIDENTS_STAGE
+    path = stage.output_path(data_folder, filename)
+    if not force and stage.is_fresh(data_folder, filename):
+        return read_features(path)
     else:
-        df_characteristics = pd.read_csv(
-            os.path.join(data_folder, Datasets.ACCIDENTS_CHARACTERISTICS.filename), sep=";"
-        )
-        df_places = pd.read_csv(os.path.join(data_folder, Datasets.ACCIDENTS_PLACES.filename), sep=";")
-        df_users = pd.read_csv(os.path.join(data_folder, Datasets.ACCIDENTS_USERS.filename), sep=";")
-        df_vehicles = pd.read_csv(os.path.join(data_folder, Datasets.ACCIDENTS_VEHICULES.filename), sep=";")
-        df_accident_features = build_accidents_features(df_characteristics, df_places, df_users, df_vehicles)
-        df_accident_features.to_csv(path, index=False)
+        locate = stage.params["commune_assignment"] == "coordinates"
+        metadata = None
+        with profile_stage("accident preprocessing") as profile:
+            df_characteristics, df_places, df_users, df_vehicles = _read_accidents(data_folder, coordinates=locate)
+            profile.rows_in = sum(map(len, (df_characteristics, df_places, df_users, df_vehicles)))
+            if locate:
+                codes, communes = _read_communes(data_folder)
+                # A shard locates only the accidents around its communes, and reports on its accidents only
+                df_characteristics, report = locate_accidents(
+                    df_characteristics, communes, codes, PROJECTED_CRS, department=department
+                )
+                metadata = {ASSIGNMENT_METADATA_KEY: json.dumps(asdict(report))}
+            elif department:
+                df_characteristics = _restrict_to_department(df_characteristics, department, "com")
+            df_accident_features = build_accidents_features(df_characteristics, df_places, df_users, df_vehicles)
+            profile.rows_out = len(df_accident_features)
+        df_accident_features = write_features(df_accident_features, path, ACCIDENT_FEATURES_SCHEMA, metadata=metadata)
+        stage.mark_built(data_folder, filename)
         return df_accident_features
 
 
-def get_bike_lane_features(data_folder: str, filename: str = "bike_lane_features.csv") -> pd.DataFrame:
+def get_lane_distance_features(
+    data_folder: str,
+    filename: str = LANE_DISTANCES_STAGE.filename,
+    force: bool = False,
+    years: Iterable[int] = (2021,),
+) -> pd.DataFrame:
+    """Returns a panda dataframe containing how close to a bike lane the bike accidents of some years happened
+    in each commune: the share of the accidents near a bike lane, and near each type of bike lane.
+    The accidents of each year are read by chunks, see `read_bike_accidents`, and located in the communes from
+    their coordinates, see `locate_accidents`.
+    Loads it if the file is up to date with its inputs, else computes it and saves the result.
+
+    Args:
+        data_folder (str, optional): Parent folder contaning all the datasets.
+        filename (str, optional): Name underwhich to save the dataframe. Defaults to "lane_distance_features.parquet".
+        force (bool, optional): Recompute the features even if they are up to date. Defaults to False.
+        years (Iterable[int], optional): Years of the BAAC releases to measure, whose files must be in the data
+            folder, see `baac_path`. Defaults to 2021, the release downloaded by `Datasets`.
+
+    Returns:
+        pd.DataFrame: df containing the lane distance features, see `build_lane_distance_features`
+    """
+    years = sorted(set(years))
+    # Only the 2021 release is in Datasets: the checksums of the files of the years are part of the key
+    stage = replace(
+        LANE_DISTANCES_STAGE,
+        params={
+            **LANE_DISTANCES_STAGE.params,
+            "years": {str(year): baac_checksums(data_folder, year) for year in years},
+        },
+    )
+    path = stage.output_path(data_folder, filename)
+    if not force and stage.is_fresh(data_folder, filename):
+        return read_features(path)
+    else:
+        params = stage.params
+        df_accidents = pd.concat(
+            [read_bike_accidents(data_folder, year, coordinates=True) for year in years], ignore_index=True
+        )
+        codes, communes = _read_communes(data_folder)
+        df_accidents, _ = locate_accidents(df_accidents, communes, codes, PROJECTED_CRS)
+        longitudes, latitudes = df_accidents["long"].to_numpy(), df_accidents["lat"].to_numpy()
+        points = shapely.points(*project_coordinates(longitudes, latitudes, "EPSG:4326", PROJECTED_CRS))
+        points[np.isnan(longitudes) | np.isnan(latitudes)] = None
+
+        df_lane_types, lanes = get_lane_geometries(data_folder, columns=["ame_d", "ame_g"])
+        df_lane_distances = build_lane_distance_features(
+            df_accidents["com"], points, lanes, df_lane_types, params["near_distance"], params["max_distance"]
+        )
+        df_lane_distances = write_features(df_lane_distances, path, LANE_DISTANCE_FEATURES_SCHEMA)
+        stage.mark_built(data_folder, filename)
+        return df_lane_distances
+
+
+def get_assignment_report(
+    data_folder: str, filename: str = ACCIDENTS_STAGE.filename, departments: list[str] | None = None
+) -> AssignmentReport | None:
+    """Returns how many accidents were located in a commune when the accident features were computed.
+
+    Args:
+        data_folder (str): Parent folder contaning all the datasets.
+        filename (str, optional): Name of the saved features. Defaults to "accidents_features.parquet".
+        departments (list[str], optional): Sum the reports of the shards of these départements, see
+            `get_training_data`. Defaults to None, meaning the report of the features of all the communes.
+
+    Returns:
+        AssignmentReport | None: the report, None if the features are missing or were built from the commune codes
+    """
+    stages = [ACCIDENTS_STAGE.shard(department) for department in departments] if departments else [ACCIDENTS_STAGE]
+    reports = []
+    for stage in stages:
+        path = stage.output_path(data_folder, filename)
+        report = read_metadata(path).get(ASSIGNMENT_METADATA_KEY) if os.path.exists(path) else None
+        if not report:
+            return None
+        reports.append(json.loads(report))
+    return AssignmentReport(**{field: sum(report[field] for report in reports) for field in reports[0]})
+
+
+def get_accidents_by_year(
+    data_folder: str,
+    filename: str = ACCIDENTS_BY_YEAR_STAGE.filename,
+    years: Iterable[int] = BAAC_YEARS,
+    departments: list[str] | None = None,
+    force: bool = False,
+) -> pd.DataFrame:
+    """Returns a panda dataframe containing the number of bike accidents per commune and per year,
+    from 2005 to 2021 by default. The BAAC files of the years must be in the data folder, see `baac_path`.
+    The years already saved are loaded, only the new ones, and the ones whose files changed since they were
+    counted, are computed and merged into the saved table, see `get_years_to_count`. The saved years that are
+    not requested stay in the table.
+
+    Args:
+        data_folder (str, optional): Parent folder contaning all the datasets.
+        filename (str, optional): Name underwhich to save the dataframe. Defaults to "accidents_by_year.parquet".
+        years (Iterable[int], optional): Years to return. Defaults to BAAC_YEARS.
+        departments (list[str], optional): Départements of the communes to load. Defaults to None, meaning all.
+        force (bool, optional): Recompute every year even if it is already saved. Defaults to False.
+
+    Returns:
+        pd.DataFrame: df with the columns "code_commune", "year" and "accident_num"
+    """
+    path = ACCIDENTS_BY_YEAR_STAGE.output_path(data_folder, filename)
+    years = sorted(set(years))
+    saved_checksums = _saved_checksums(data_folder, filename)
+    new_years = get_years_to_count(data_folder, years, force, filename)
+    included_years = [year for year in saved_checksums if year not in new_years]
+
+    if new_years:
+        df_accidents = build_accidents_by_year(data_folder, new_years)
+        if included_years:
+            # The saved counts of the years recounted because their files changed are replaced
+            df_saved = read_features(path)
+            df_accidents = pd.concat([df_saved[df_saved["year"].isin(included_years)], df_accidents], ignore_index=True)
+        checksums = {year: saved_checksums[year] for year in included_years}
+        checksums.update({year: baac_checksums(data_folder, year) for year in new_years})
+        df_accidents = write_features(
+            df_accidents,
+            path,
+            ACCIDENTS_BY_YEAR_SCHEMA,
+            metadata={
+                YEARS_METADATA_KEY: json.dumps(sorted(checksums)),
+                CHECKSUMS_METADATA_KEY: json.dumps({str(year): checksums[year] for year in sorted(checksums)}),
+            },
+        )
+        ACCIDENTS_BY_YEAR_STAGE.mark_built(data_folder, filename)
+        df_accidents = filter_features(df_accidents, departments=departments)
+    else:
+        df_accidents = read_features(path, departments=departments)
+    return df_accidents[df_accidents["year"].isin(years)].reset_index(drop=True)
+
+
+def get_included_years(data_folder: str, filename: str = ACCIDENTS_BY_YEAR_STAGE.filename) -> list[int]:
+    """Tells which years are already counted in the table of `get_accidents_by_year`, from files that did not
+    change since. A year whose files are no longer in the data folder is kept, as it cannot be recounted.
+
+    Args:
+        data_folder (str): Parent folder contaning all the datasets.
+        filename (str, optional): Name of the saved dataframe. Defaults to "accidents_by_year.parquet".
+
+    Returns:
+        list[int]: the up-to-date years saved in the table, none if it is missing or was built by another
+        version of the code
+    """
+    included_years = []
+    for year, checksums in _saved_checksums(data_folder, filename).items():
+        current = baac_checksums(data_folder, year)
+        if all(checksums.get(name) == md5sum for name, md5sum in current.items()):
+            included_years.append(year)
+    return included_years
+
+
+def get_years_to_count(
+    data_folder: str, years: Iterable[int], force: bool = False, filename: str = ACCIDENTS_BY_YEAR_STAGE.filename
+) -> list[int]:
+    """Tells which years `get_accidents_by_year` counts: the requested years that are not saved yet, and the saved
+    years, requested or not, whose files changed since they were counted, see `get_included_years`.
+
+    Args:
+        data_folder (str): Parent folder contaning all the datasets.
+        years (Iterable[int]): Years requested.
+        force (bool, optional): Recount the requested years and the saved years whose files are still in the data
+            folder. Defaults to False.
+        filename (str, optional): Name of the saved dataframe. Defaults to "accidents_by_year.parquet".
+
+    Returns:
+        list[int]: the sorted years to count
+    """
+    # A saved year whose files are no longer all in the data folder cannot be recounted
+    saved_checksums = _saved_checksums(data_folder, filename)
+    saved_years = [
+        year
+        for year in _saved_years(data_folder, filename)
+        if set(saved_checksums.get(year, {})) <= set(baac_checksums(data_folder, year))
+    ]
+    included_years = [] if force else get_included_years(data_folder, filename)
+    return sorted(year for year in set(years) | set(saved_years) if year not in included_years)
+
+
+def _saved_years(data_folder: str, filename: str) -> list[int]:
+    # Years counted in the table
+    if not ACCIDENTS_BY_YEAR_STAGE.is_fresh(data_folder, filename):
+        return []
+    metadata = read_metadata(ACCIDENTS_BY_YEAR_STAGE.output_path(data_folder, filename))
+    return json.loads(metadata.get(YEARS_METADATA_KEY, "[]"))
+
+
+def _saved_checksums(data_folder: str, filename: str) -> dict[int, dict[str, str]]:
+    # Checksums of the files of each year saved in the table, by file name
+    if not ACCIDENTS_BY_YEAR_STAGE.is_fresh(data_folder, filename):
+        return {}
+    metadata = read_metadata(ACCIDENTS_BY_YEAR_STAGE.output_path(data_folder, filename))
+    return {int(year): checksums for year, checksums in json.loads(metadata.get(CHECKSUMS_METADATA_KEY, "{}")).items()}
+
+
+def _read_accidents(
+    data_folder: str, coordinates: bool = False
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    files = {
+        "characteristics": Datasets.ACCIDENTS_CHARACTERISTICS,
+        "places": Datasets.ACCIDENTS_PLACES,
+        "users": Datasets.ACCIDENTS_USERS,
+        "vehicles": Datasets.ACCIDENTS_VEHICULES,
+    }
+    columns = {**ACCIDENTS_COLUMNS}
+    if coordinates:
+        columns["characteristics"] = columns["characteristics"] + COORDINATE_COLUMNS
+    df_characteristics, df_places, df_users, df_vehicles = [
+        pd.read_csv(
+            os.path.join(data_folder, remote_file.filename),
+            sep=";",
+            usecols=columns[table],
+            dtype={"com": str, "lat": str, "long": str},
+        )
+        for table, remote_file in files.items()
+    ]
+    return df_characteristics, df_places, df_users, df_vehicles
+
+
+def _restrict_to_department(df: pd.DataFrame, department: str, commune_column: str) -> pd.DataFrame:
+    return df[in_department(df, [commune_column], department)].reset_index(drop=True)
+
+
+def _read_communes(data_folder: str) -> tuple[np.ndarray, np.ndarray]:
+    df_communes, communes = get_commune_geometries(data_folder)
+    return df_communes["insee_com"].to_numpy(), communes
+
+
+def get_commune_geometries(
+    data_folder: str, department: str | None = None, force: bool = False
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """Returns the polygons of the communes projected to PROJECTED_CRS, and their "insee_com" code.
+    Loads them from the geometry cache if it is up to date, else builds it first.
+
+    Args:
+        data_folder (str): Parent folder contaning all the datasets.
+        department (str, optional): Load only the communes of this département. Defaults to None, meaning all.
+        force (bool, optional): Rebuild the cache even if it is up to date. Defaults to False.
+
+    Returns:
+        tuple[pd.DataFrame, np.ndarray]: the normalized code of the communes, and their shapely polygons
+    """
+    path = _build_geometries(COMMUNE_GEOMETRIES_STAGE, data_folder, force=force)
+    df_communes, communes = read_geometry_cache(path, columns=["insee_com"])
+    df_communes["insee_com"] = normalize_commune_codes(df_communes["insee_com"])
+    if department:
+        selected = (department_code(df_communes["insee_com"]) == department).to_numpy()
+        df_communes, communes = df_communes[selected].reset_index(drop=True), communes[selected]
+    return df_communes, communes
+
+
+def get_lane_geometries(
+    data_folder: str,
+    columns: list[str] = BIKE_LANE_COLUMNS,
+    bbox: tuple[float, float, float, float] | None = None,
+    force: bool = False,
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """Returns the bike lanes projected to PROJECTED_CRS, and their attributes, see `get_commune_geometries`.
+
+    Args:
+        data_folder (str): Parent folder contaning all the datasets.
+        columns (list[str], optional): Attributes to load. Defaults to BIKE_LANE_COLUMNS.
+        bbox (tuple[float, float, float, float], optional): Load only the lanes around this box, in PROJECTED_CRS.
+            Defaults to None, meaning all.
+        force (bool, optional): Rebuild the cache even if it is up to date. Defaults to False.
+
+    Returns:
+        tuple[pd.DataFrame, np.ndarray]: the attributes of the lanes, and their shapely geometries
+    """
+    path = _build_geometries(LANE_GEOMETRIES_STAGE, data_folder, force=force)
+    return read_geometry_cache(path, columns=columns, bbox=bbox)
+
+
+def get_lane_attributes(
+    data_folder: str, columns: list[str], bbox: tuple[float, float, float, float] | None = None, force: bool = False
+) -> pd.DataFrame:
+    """Returns attributes of the bike lanes, such as their length in PROJECTED_CRS, without their geometries.
+
+    Args:
+        data_folder (str): Parent folder contaning all the datasets.
+        columns (list[str]): Attributes to load, from BIKE_LANE_COLUMNS and LENGTH_COLUMN.
+        bbox (tuple[float, float, float, float], optional): Load only the lanes around this box, in PROJECTED_CRS.
+            Defaults to None, meaning all.
+        force (bool, optional): Rebuild the cache even if it is up to date. Defaults to False.
+
+    Returns:
+        pd.DataFrame: the attributes of the lanes
+    """
+    path = _build_geometries(LANE_GEOMETRIES_STAGE, data_folder, force=force)
+    return read_cached_attributes(path, columns, bbox)
+
+
+def get_road_geometries(
+    data_folder: str, bbox: tuple[float, float, float, float] | None = None, force: bool = False
+) -> np.ndarray:
+    """Returns the roads projected to PROJECTED_CRS, see `get_commune_geometries`.
+
+    Args:
+        data_folder (str): Parent folder contaning all the datasets.
+        bbox (tuple[float, float, float, float], optional): Load only the roads around this box, in PROJECTED_CRS.
+            Defaults to None, meaning all.
+        force (bool, optional): Rebuild the cache even if it is up to date. Defaults to False.
+
+    Returns:
+        np.ndarray: the shapely geometries of the roads
+    """
+    path = _build_geometries(ROAD_GEOMETRIES_STAGE, data_folder, force=force)
+    return read_geometry_cache(path, bbox=bbox)[1]
+
+
+# Source file, attributes and coordinate reference system of the geometries cached by each stage
+_GEOMETRY_SOURCES = {
+    COMMUNE_GEOMETRIES_STAGE.name: (Datasets.INSEE_COM.filename, ["insee_com"], "EPSG:4326"),
+    LANE_GEOMETRIES_STAGE.name: (Datasets.CYCLING_LANES.filename, BIKE_LANE_COLUMNS, "EPSG:4326"),
+    # first file is .sph, second is .shx
+    ROAD_GEOMETRIES_STAGE.name: (list(Datasets.ROADS.path_files_to_keep.values())[0], None, "EPSG:2154"),
+}
+
+
+def _build_geometries(stage: Stage, data_folder: str, force: bool = False) -> str:
+    path = stage.output_path(data_folder)
+    if force or not stage.is_fresh(data_folder):
+        source_filename, columns, source_crs = _GEOMETRY_SOURCES[stage.name]
+        with profile_stage(stage.name) as profile:
+            profile.rows_out = build_geometry_cache(
+                os.path.join(data_folder, source_filename), path, columns, source_crs, stage.params["crs"]
+            )
+        stage.mark_built(data_folder)
+    return path
+
+
+def get_bike_lane_features(
+    data_folder: str,
+    filename: str = BIKE_LANES_STAGE.filename,
+    force: bool = False,
+    department: str | None = None,
+    attribution: str = "attributes",
+) -> pd.DataFrame:
     """Returns a panda dataframe containing the feature about the bike lanes, i.e. the total length
     of bike lanes in the commune as well as the length for each type of bike lane.
-    Loads it if the file already exists, else computes it and saves the result.
+    Loads it if the file is up to date with its inputs, else computes it and saves the result.
 
     Args:
         data_folder (str, optional): Parent folder contaning all the datasets.
-        filename (str, optional): Name underwhich to save the dataframe. Defaults to "bike_lane_features.csv".
+        filename (str, optional): Name underwhich to save the dataframe. Defaults to "bike_lane_features.parquet".
+        force (bool, optional): Recompute the features even if they are up to date. Defaults to False.
+        department (str, optional): Compute only the communes of this département. Defaults to None, meaning all.
+        attribution (str, optional): "attributes" attributes the lanes to the communes of their "code_com_d" and
+            "code_com_g" attributes, "spatial" intersects their geometry with the communes, see
+            `build_bike_lanes_features`. Defaults to "attributes".
 
     Returns:
         pd.DataFrame: df containing the bike lanes features
     """
-    path = os.path.join(data_folder, filename)
-    if os.path.exists(path):
-        return pd.read_csv(path, index_col=None)
+    stage = _bike_lanes_stage(attribution)
+    stage = stage.shard(department) if department else stage
+    path = stage.output_path(data_folder, filename)
+    if not force and stage.is_fresh(data_folder, filename):
+        return read_features(path, commune_column="insee_com")
     else:
-        bike_lane_geojson_name = Datasets.CYCLING_LANES.filename
-        df_bike_lanes = gpd.read_file(os.path.join(data_folder, bike_lane_geojson_name))
-        bike_lane_features = build_bike_lanes_features(df_bike_lanes)
-        bike_lane_features.to_csv(path, index=False)
+        if stage.params["attribution"] == "spatial":
+            df_communes, communes = get_commune_geometries(data_folder, department)
+            # Only the lanes around the communes are read
+            bbox = tuple(shapely.total_bounds(communes)) if department and len(communes) else None
+            if len(communes):
+                df_bike_lanes, lanes = get_lane_geometries(data_folder, ["ame_d", "ame_g"], bbox)
+            else:
+                df_bike_lanes, lanes = pd.DataFrame(columns=["ame_d", "ame_g"]), np.empty(0, dtype=object)
+            with profile_stage("bike lane aggregation", rows_in=len(lanes)) as profile:
+                bike_lane_features = build_bike_lanes_features(
+                    gpd.GeoDataFrame(df_bike_lanes, geometry=lanes, crs=PROJECTED_CRS),
+                    PROJECTED_EPSG,
+                    df_communes=gpd.GeoDataFrame(df_communes, geometry=communes, crs=PROJECTED_CRS),
+                )
+                profile.rows_out = len(bike_lane_features)
+        else:
+            # The lengths were measured when caching the lanes: only their attributes are read
+            bbox = None
+            if department:
+                communes = get_commune_geometries(data_folder, department)[1]
+                bbox = tuple(shapely.total_bounds(communes)) if len(communes) else None
+            df_bike_lanes = get_lane_attributes(data_folder, BIKE_LANE_COLUMNS + [LENGTH_COLUMN], bbox)
+            if department:
+                selected = in_department(df_bike_lanes, ["code_com_d", "code_com_g"], department)
+                df_bike_lanes = df_bike_lanes[selected].reset_index(drop=True)
+            with profile_stage("bike lane aggregation", rows_in=len(df_bike_lanes)) as profile:
+                bike_lane_features = build_bike_lanes_features(df_bike_lanes)
+                if department:
+                    # Lanes crossing the border of the département are also measured in the neighbouring communes
+                    bike_lane_features = _restrict_to_department(bike_lane_features, department, "insee_com")
+                profile.rows_out = len(bike_lane_features)
+        bike_lane_features = write_features(
+            bike_lane_features, path, BIKE_LANE_FEATURES_SCHEMA, commune_column="insee_com"
+        )
+        stage.mark_built(data_folder, filename)
         return bike_lane_features
 
 
-def get_roads_features(data_folder, filename="roads_length.csv"):
+def _bike_lanes_stage(attribution: str) -> Stage:
+    if attribution not in LANE_ATTRIBUTIONS:
+        raise ValueError(f"Unknown attribution of the bike lanes {attribution!r}, expected one of {LANE_ATTRIBUTIONS}.")
+    return replace(BIKE_LANES_STAGE, params={**BIKE_LANES_STAGE.params, "attribution": attribution})
+
+
+def _training_stage(attribution: str) -> Stage:
+    # The bike lane features of the training data depend on their attribution
+    return replace(TRAINING_STAGE, depends_on=[ACCIDENTS_STAGE, _bike_lanes_stage(attribution), ROADS_STAGE])
+
+
+def get_roads_features(
+    data_folder: str, filename: str = ROADS_STAGE.filename, force: bool = False, department: str | None = None
+) -> pd.DataFrame:
     """Returns a panda dataframe containing the feature about the roads, i.e. the total length
     of roads in a commune.
-    Loads it if the file already exists, else computes it and saves the result.
+    Loads it if the file is up to date with its inputs, else computes it and saves the result.
 
     Args:
         data_folder (str, optional): Parent folder contaning all the datasets.
-        filename (str, optional): Name underwhich to save the dataframe. Defaults to "roads_length.csv".
+        filename (str, optional): Name underwhich to save the dataframe. Defaults to "roads_length.parquet".
+        force (bool, optional): Recompute the features even if they are up to date. Defaults to False.
+        department (str, optional): Compute only the communes of this département. Defaults to None, meaning all.
 
     Returns:
         pd.DataFrame: df containing the length of the roads for each commune
     """
-    path = os.path.join(data_folder, filename)
-    if os.path.exists(path):
-        return pd.read_csv(path, index_col=None)
+    stage = ROADS_STAGE.shard(department) if department else ROADS_STAGE
+    path = stage.output_path(data_folder, filename)
+    if not force and stage.is_fresh(data_folder, filename):
+        return read_features(path, commune_column="insee_com")
     else:
-        commune_geojson_name = Datasets.INSEE_COM.filename
-        roads_shapefile_name = list(Datasets.ROADS.path_files_to_keep.values())[0]  # first file is .sph, second is .shx
-        roads_features = build_roads_features(
-            os.path.join(data_folder, commune_geojson_name), os.path.join(data_folder, roads_shapefile_name)
-        )
-        roads_features.to_csv(path, index=False)
+        df_communes, communes = get_commune_geometries(data_folder, department)
+        # For a single département, only the roads around its communes are read
+        bbox = tuple(shapely.total_bounds(communes)) if department and len(communes) else None
+        roads = get_road_geometries(data_folder, bbox) if len(communes) else np.empty(0, dtype=object)
+        roads_features = get_road_length_by_commune(df_communes["insee_com"].to_numpy(), communes, roads)
+        roads_features = write_features(roads_features, path, ROADS_FEATURES_SCHEMA, commune_column="insee_com")
+        stage.mark_built(data_folder, filename)
         return roads_features
 
 
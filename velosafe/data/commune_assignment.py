@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+from velosafe.data.feature_store import department_code, normalize_commune_codes
+from velosafe.data.projection import project_coordinates
+
+# Columns of the BAAC characteristics table holding the WGS84 location of the accidents
+COORDINATE_COLUMNS = ["lat", "long"]
+
+
+@dataclass
+class AssignmentReport:
+    """Outcome of the assignment of accidents to the communes containing them, see `locate_accidents`."""
+
+    n_points: int
+    # Accidents without coordinates
+    n_missing: int
+    # Accidents whose coordinates are outside every commune
+    n_unmatched: int
+    # Accidents located in another commune than the one of their code
+    n_relocated: int
+
+    @property
+    def unmatched_rate(self) -> float:
+        """
+        Share of the accidents that kept the commune of their code, as they could not be located.
+        """
+        return (self.n_missing + self.n_unmatched) / self.n_points if self.n_points else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.n_points} accidents, {self.n_missing} without coordinates, {self.n_unmatched} outside every "
+            f"commune ({self.unmatched_rate:.2%} unmatched), {self.n_relocated} moved to another commune"
+        )
+
+
+def parse_coordinates(values: pd.Series) -> np.ndarray:
+    """Converts coordinates written with a decimal comma, e.g. "48,8566", to floats.
+
+    Args:
+        values (pd.Series): the coordinates, as strings or numbers
+
+    Returns:
+        np.ndarray: the coordinates, NaN where they are missing or invalid
+    """
+    if not pd.api.types.is_numeric_dtype(values):
+        values = values.astype("string").str.replace(",", ".", regex=False)
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=float)
+
+
+def assign_communes(x: np.ndarray, y: np.ndarray, polygons: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Finds the commune containing each point. All the points are queried at once in a STRtree of the communes.
+
+    Args:
+        x (np.ndarray): abscissas (longitudes) of the points, NaN if unknown
+        y (np.ndarray): ordinates (latitudes) of the points, in the coordinate system of the polygons
+        polygons (np.ndarray): shapely polygons of the communes
+        codes (np.ndarray): code of each commune
+
+    Returns:
+        np.ndarray: the code of the commune containing each point, None if it is outside every commune.
+        A point on the border of several communes gets the first one.
+    """
+    points = shapely.points(x, y)
+    point_index, polygon_index = STRtree(polygons).query(points, predicate="intersects")
+    # The pairs are sorted by point, keep the first commune of each point
+    point_index, first = np.unique(point_index, return_index=True)
+
+    assigned = np.full(len(points), None, dtype=object)
+    assigned[point_index] = np.asarray(codes, dtype=object)[polygon_index[first]]
+    return assigned
+
+
+def locate_accidents(
+    df_characteristics: pd.DataFrame,
+    polygons: np.ndarray,
+    codes: np.ndarray,
+    crs: str = "EPSG:4326",
+    department: str | None = None,
+) -> tuple[pd.DataFrame, AssignmentReport]:
+    """Replaces the commune code of the accidents by the code of the commune containing their location.
+    The codes of the BAAC do not always match the ones of the communes map, e.g. after communes merged.
+    Accidents that cannot be located keep their code.
+
+    Args:
+        df_characteristics (pd.DataFrame): characteristics of the accidents, with the "com", "lat" and "long"
+            columns
+        polygons (np.ndarray): shapely polygons of the communes
+        codes (np.ndarray): normalized code of each commune, see `normalize_commune_codes`
+        crs (str, optional): coordinate reference system of the polygons, the WGS84 coordinates of the
+            accidents are projected to it. Defaults to "EPSG:4326".
+        department (str, optional): keep only the accidents assigned to a commune of this département. Only the
+            accidents around its communes, or with a code in it, are located. Defaults to None, meaning all.
+
+    Returns:
+        tuple[pd.DataFrame, AssignmentReport]: a copy of the characteristics with the new codes, and the number
+        of accidents that were located
+    """
+    x = parse_coordinates(df_characteristics["long"])
+    y = parse_coordinates(df_characteristics["lat"])
+    missing = np.isnan(x) | np.isnan(y)
+    x, y = project_coordinates(x, y, "EPSG:4326", crs)
+    communes = df_characteristics["com"].to_numpy(dtype=object)
+    if department:
+        # The other accidents can only be assigned to communes of other départements
+        around = np.zeros(len(x), dtype=bool)
+        department_polygons = polygons[_in_department(codes, department)]
+        if len(department_polygons):
+            minx, miny, maxx, maxy = shapely.total_bounds(department_polygons)
+            around = (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+        candidates = np.flatnonzero(around | _in_department(communes, department))
+        df_characteristics, communes = df_characteristics.iloc[candidates], communes[candidates]
+        x, y, missing = x[candidates], y[candidates], missing[candidates]
+    assigned = assign_communes(x, y, polygons, codes)
+    located = pd.notna(assigned)
+    if department:
+        kept = _in_department(np.where(located, assigned, communes), department)
+        df_characteristics, communes, assigned = df_characteristics[kept], communes[kept], assigned[kept]
+        missing, located = missing[kept], located[kept]
+
+    report = AssignmentReport(
+        n_points=len(df_characteristics),
+        n_missing=int(missing.sum()),
+        n_unmatched=int((~located & ~missing).sum()),
+        n_relocated=int((located & (assigned != communes)).sum()),
+    )
+    return df_characteristics.assign(com=np.where(located, assigned, communes)), report
+
+
+def _in_department(codes: np.ndarray, department: str) -> np.ndarray:
+    return (department_code(normalize_commune_codes(pd.Series(codes, dtype=object))) == department).to_numpy()
@@ -1,5 +1,16 @@
 from .download import RemoteFile, ZipRemoteFile
 
+# Codes of the départements of the communes: metropolitan France, with Corsica split in 2A and 2B, and overseas
+DEPARTMENT_CODES = [f"{code:02d}" for code in range(1, 96) if code != 20] + [
+    "2A",
+    "2B",
+    "971",
+    "972",
+    "973",
+    "974",
+    "976",
+]
+
 
 class Datasets:
     INSEE_COM = RemoteFile(
@@ -44,7 +55,6 @@ class Datasets:
         url="https://wxs.ign.fr/pfinqfa9win76fllnimpfmbi/telechargement/inspire/ROUTE500-France-2021$ROUTE500_3-0__SHP_LAMB93_FXX_2021-11-03/file/ROUTE500_3-0__SHP_LAMB93_FXX_2021-11-03.7z",
         filename="ROUTE_500.7z",
         md5sum="e336ce8b1b94318280fec8b96de9ed58",
-        foldername_after_unzipping="ROUTE500_3-0__SHP_LAMB93_FXX_2021-11-03",
         path_files_to_keep={
             (
                 "ROUTE500_3-0__SHP_LAMB93_FXX_2021-11-03/ROUTE500/1_DONNEES_LIVRAISON_2022-01-00175/"
@@ -1,14 +1,73 @@
 import hashlib
+import json
 import os
-import shutil
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict
-from urllib.request import urlopen
+from typing import Dict, Iterable
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
 
-import py7zr
 from tqdm import tqdm
 
+from velosafe.data.atomic import atomic_path
+from velosafe.data.profiling import profile_stage
+
+MANIFEST_FILENAME = "checksums.json"
+# Base URL, or local folder, of a mirror of the datasets: when set, every file is downloaded from the mirror,
+# under its `filename`, instead of its original URL. Used on machines without access to the internet.
+MIRROR_ENV_VAR = "VELOSAFE_MIRROR"
+# Optional file of a mirror mapping the names of its files to their md5 checksums, for mirrors serving other
+# files than the original datasets, e.g. small fixtures
+MIRROR_CHECKSUMS_FILENAME = "md5sums.json"
+# Checksums listed by each mirror, see `mirror_checksums`
+_mirror_checksums: dict[str, dict[str, str]] = {}
+
+
+class ChecksumManifest:
+    """Sidecar file remembering the size, modification time and md5 of the files of a directory,
+    so that a file which did not change since it was hashed can be verified without reading it again.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, directory: str | Path):
+        self.path = Path(directory).expanduser() / MANIFEST_FILENAME
+
+    def checksum(self, file: Path) -> str:
+        """
+        Return the md5 checksum of a file, reading it only if it changed since it was last recorded.
+        """
+        stat = file.stat()
+        entry = self._load().get(file.name)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["md5"]
+        md5sum = RemoteFile.checksum(file)
+        self.record(file, md5sum)
+        return md5sum
+
+    def record(self, file: Path, md5sum: str) -> None:
+        """
+        Store the md5 checksum of a file along with its current size and modification time.
+        """
+        stat = file.stat()
+        with self._lock:
+            entries = self._load()
+            entries[file.name] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "md5": md5sum}
+            with atomic_path(str(self.path)) as tmp_path:
+                with open(tmp_path, "w") as f:
+                    json.dump(entries, f, indent=2, sort_keys=True)
+
+    def _load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
 
 @dataclass
 class RemoteFile:
@@ -17,39 +76,104 @@ class RemoteFile:
     md5sum: str | None = None
 
     def download(
-        self, dest_dir: str | Path = "data", show_progress: bool = True, chunk_size: int = 1024 * 1024
+        self,
+        dest_dir: str | Path = "data",
+        show_progress: bool = True,
+        chunk_size: int = 1024 * 1024,
+        progress_position: int | None = None,
     ) -> Path:
         """
         Download the file located at url to dest_file.
 
-        Will follow redirects.
+        Will follow redirects. The data is first written to a `.part` file: if the download is interrupted,
+        the next call resumes from where it stopped using an HTTP Range request, when the server supports it.
+        The md5 checksum is computed while the data is written, and stored in the checksum manifest of dest_dir.
         :param dest_dir: The file destination directory.
         :param show_progress: Print a progress bar to stdout if set to True.
         :param chunk_size: Number of bits to download before saving stream to file.
+        :param progress_position: Line of the progress bar, when several files are downloaded at the same time.
 
         :return: The file the dataset was downloaded to.
         """
         if self.filename:
             dest_file = Path(dest_dir).expanduser() / self.filename
-        if dest_file.exists() and self.md5sum is not None and self.checksum(dest_file) == self.md5sum:
+        md5sum = self.expected_md5sum()
+        manifest = ChecksumManifest(dest_file.parent)
+        if dest_file.exists() and md5sum is not None and manifest.checksum(dest_file) == md5sum:
             return dest_file
         # Ensure the directory we'll put the downloaded file in actually exists
         dest_file.parent.mkdir(parents=True, exist_ok=True)
-        with urlopen(self.url) as response:
+        part_file = dest_file.with_name(dest_file.name + ".part")
+        offset = part_file.stat().st_size if part_file.exists() else 0
+        request = Request(self.source_url, headers={"Range": f"bytes={offset}-"} if offset else {})
+        try:
+            response = urlopen(request)
+        except HTTPError as error:
+            if error.code != 416:
+                raise
+            # The range starts at the end of the file: the partial file may be complete already
+            if md5sum is not None and RemoteFile.checksum(part_file) == md5sum:
+                os.replace(part_file, dest_file)
+                manifest.record(dest_file, md5sum)
+                return dest_file
+            part_file.unlink()
+            return self.download(dest_dir, show_progress, chunk_size, progress_position)
+        with response:
+            if offset and _content_range_start(response) != offset:
+                if response.status == 206:
+                    # Another range than the missing one: the partial file is dropped and the whole file requested
+                    response.close()
+                    part_file.unlink()
+                    return self.download(dest_dir, show_progress, chunk_size, progress_position)
+                # The server ignored the Range header and sends the whole file, so does a file:// mirror: it
+                # replaces the partial file
+                offset = 0
             file_size = response.headers["Content-Length"]
             if file_size is not None:
-                file_size = int(file_size)
+                file_size = offset + int(file_size)
             else:
                 show_progress = False
-            with open(dest_file, "wb") as db_file:
-                with tqdm(total=file_size, unit="B", unit_scale=True, disable=not show_progress) as progress_bar:
+            hasher = hashlib.md5()
+            if offset:
+                # Only the part that was already downloaded needs to be read again
+                _update_hash(hasher, part_file)
+            with open(part_file, "ab" if offset else "wb") as db_file:
+                with tqdm(
+                    total=file_size,
+                    initial=offset,
+                    desc=str(self.filename),
+                    unit="B",
+                    unit_scale=True,
+                    disable=not show_progress,
+                    position=progress_position,
+                ) as progress_bar:
                     while chunk := response.read(chunk_size):
                         db_file.write(chunk)
-                        progress_bar.update(chunk_size)
-            if self.md5sum is not None and self.checksum(dest_file) != self.md5sum:
-                dest_file.unlink()
-                raise ValueError("File was corrupted during download. Please try again.")
-            return dest_file
+                        hasher.update(chunk)
+                        progress_bar.update(len(chunk))
+        if md5sum is not None and hasher.hexdigest() != md5sum:
+            part_file.unlink()
+            raise ValueError("File was corrupted during download. Please try again.")
+        os.replace(part_file, dest_file)
+        manifest.record(dest_file, hasher.hexdigest())
+        return dest_file
+
+    @property
+    def source_url(self) -> str:
+        """
+        URL the file is downloaded from: its copy in the mirror set in VELOSAFE_MIRROR if any, else `url`.
+        """
+        mirror = os.environ.get(MIRROR_ENV_VAR)
+        return mirror_url(mirror, str(self.filename)) if mirror else self.url
+
+    def expected_md5sum(self) -> str | None:
+        """
+        Return the md5 checksum of the file, the one listed by the mirror if it lists one, else `md5sum`.
+        """
+        mirror = os.environ.get(MIRROR_ENV_VAR)
+        if mirror:
+            return mirror_checksums(mirror).get(str(self.filename), self.md5sum)
+        return self.md5sum
 
     @classmethod
     def checksum(self, file: Path) -> str:
@@ -57,13 +181,18 @@ class RemoteFile:
         Compute the md5 checksum of a file.
         """
         hasher = hashlib.md5()
-        with open(file, "rb") as f:
-            while chunk := f.read(128 * hasher.block_size):
-                hasher.update(chunk)
+        _update_hash(hasher, file)
         return hasher.hexdigest()
 
     def was_already_downloaded(self, parent_folder):
-        return os.path.exists(os.path.join(parent_folder, self.filename))
+        """
+        Check that the file exists and, if its md5 checksum is known, that it matches.
+        """
+        file = Path(parent_folder).expanduser() / self.filename
+        if not file.exists():
+            return False
+        md5sum = self.expected_md5sum()
+        return md5sum is None or ChecksumManifest(file.parent).checksum(file) == md5sum
 
 
 class ZipRemoteFile(RemoteFile):
@@ -72,12 +201,10 @@ class ZipRemoteFile(RemoteFile):
         url: str,
         filename: str,
         md5sum: str | None = None,
-        foldername_after_unzipping: str = "",
         foldername: str = "",
         path_files_to_keep: Dict[str, str] = {},
     ):
         super().__init__(url, filename, md5sum)
-        self.foldername_after_unzipping = foldername_after_unzipping
         self.foldername = foldername
         self.path_files_to_keep = path_files_to_keep
 
@@ -87,12 +214,114 @@ class ZipRemoteFile(RemoteFile):
                 return False
         return True
 
-    def unzip_7zip_file(self, parent_folder="data"):
-        with py7zr.SevenZipFile(os.path.join(parent_folder, self.filename), "r") as zip_ref:
-            zip_ref.extractall(parent_folder)
-        os.remove(os.path.join(parent_folder, self.filename))
+    def unzip_7zip_file(self, parent_folder="data", keep_archive=False):
+        """
+        Extract only the files listed in path_files_to_keep, under their new names.
+
+        The other members of the archive are never written to disk.
+        :param parent_folder: The folder containing the archive, where the files are extracted.
+        :param keep_archive: Keep the archive after the extraction, so that the files can be extracted again
+            without downloading it.
+        """
+        # py7zr is slow to import and only needed by the archives
+        import py7zr
+
+        archive = os.path.join(parent_folder, self.filename)
+        # Extract next to the destination so that moving the files to their final names is a simple rename
+        with tempfile.TemporaryDirectory(dir=parent_folder) as tmp_folder:
+            with py7zr.SevenZipFile(archive, "r") as zip_ref:
+                zip_ref.extract(path=tmp_folder, targets=list(self.path_files_to_keep))
+            for old_name, new_name in self.path_files_to_keep.items():
+                os.replace(os.path.join(tmp_folder, old_name), os.path.join(parent_folder, new_name))
+        if not keep_archive:
+            os.remove(archive)
+
+
+def mirror_url(mirror: str, filename: str) -> str:
+    """Builds the URL of a file in a mirror of the datasets, see MIRROR_ENV_VAR.
+
+    Args:
+        mirror (str): base URL of the mirror (http://, https:// or file://), or path of a local folder
+        filename (str): name of the file in the mirror
+
+    Returns:
+        str: the URL of the file
+    """
+    if "://" not in mirror:
+        mirror = Path(mirror).expanduser().resolve().as_uri()
+    return f"{mirror.rstrip('/')}/{quote(filename)}"
+
+
+def mirror_checksums(mirror: str) -> dict[str, str]:
+    """Loads the md5 checksums listed by a mirror in MIRROR_CHECKSUMS_FILENAME, once per process.
+    Only a loaded or missing list is kept: a mirror that could not be reached is asked again by the next call.
+
+    Args:
+        mirror (str): base URL or local folder of the mirror
+
+    Raises:
+        ValueError: if the list is not a JSON object mapping file names to checksums
+
+    Returns:
+        dict[str, str]: the checksum of each listed file, none if the mirror does not list them
+    """
+    if mirror not in _mirror_checksums:
+        url = mirror_url(mirror, MIRROR_CHECKSUMS_FILENAME)
+        try:
+            with urlopen(url) as response:
+                checksums = json.load(response)
+        except HTTPError as error:
+            if error.code != 404:
+                raise
+            checksums = {}
+        except URLError as error:
+            # A local mirror without the file
+            if not isinstance(error.reason, FileNotFoundError):
+                raise
+            checksums = {}
+        except json.JSONDecodeError as error:
+            raise ValueError(f"{url} is not a valid JSON file: {error}") from error
+        if not isinstance(checksums, dict) or not all(isinstance(md5sum, str) for md5sum in checksums.values()):
+            raise ValueError(f"{url} must map the names of the files of the mirror to their md5 checksums.")
+        _mirror_checksums[mirror] = checksums
+    return _mirror_checksums[mirror]
+
+
+def _download(remote_file: RemoteFile, dest_dir: str | Path, show_progress: bool, position: int) -> Path:
+    with profile_stage(f"download {remote_file.filename}"):
+        return remote_file.download(dest_dir, show_progress, progress_position=position)
+
+
+def _content_range_start(response) -> int | None:
+    # First byte sent by a 206 Partial Content response, None for any other response
+    match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range") or "")
+    return int(match[1]) if response.status == 206 and match else None
+
+
+def _update_hash(hasher: "hashlib._Hash", file: Path) -> None:
+    with open(file, "rb") as f:
+        while chunk := f.read(128 * hasher.block_size):
+            hasher.update(chunk)
+
+
+def download_all(
+    remote_files: Iterable[RemoteFile], dest_dir: str | Path = "data", max_workers: int = 4, show_progress: bool = True
+) -> list[Path]:
+    """Downloads several files concurrently, each one in its own thread with its own progress bar.
+
+    Args:
+        remote_files (Iterable[RemoteFile]): the files to download
+        dest_dir (str | Path, optional): The files destination directory. Defaults to "data".
+        max_workers (int, optional): Maximum number of simultaneous downloads. Defaults to 4.
+        show_progress (bool, optional): Print progress bars to stdout if set to True. Defaults to True.
 
-    def keep_only_necessary_files(self, parent_folder="data"):
-        for old_name, new_name in self.path_files_to_keep.items():
-            shutil.copy(os.path.join(parent_folder, old_name), os.path.join(parent_folder, new_name))
-        shutil.rmtree(os.path.join(parent_folder, self.foldername_after_unzipping))
+    Returns:
+        list[Path]: The files the datasets were downloaded to, in the same order as `remote_files`.
+    """
+    remote_files = list(remote_files)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_download, remote_file, dest_dir, show_progress, position)
+            for position, remote_file in enumerate(remote_files)
+        ]
+        return [future.result() for future in futures]
@@ -0,0 +1,244 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import is_float_dtype
+
+from velosafe.data.atomic import atomic_path
+
+# Column added to every stored table so that reads can be restricted to some départements
+DEPARTMENT_COLUMN = "code_departement"
+# Communes are sorted before writing, so small row groups let parquet statistics skip most of the file
+ROW_GROUP_SIZE = 2048
+# The commune codes are held in memory as arrow strings: 5 bytes and an offset per code instead of a python object
+COMMUNE_CODE_DTYPE = pd.StringDtype("pyarrow")
+
+# Compact types: the counts fit in 32 bits, and a float32 keeps lengths and areas to the metre up to 16,000 km
+ACCIDENT_FEATURES_SCHEMA = pa.schema([("code_commune", pa.string()), ("accident_num", pa.int32())])
+ACCIDENTS_BY_YEAR_SCHEMA = pa.schema(
+    [("code_commune", pa.string()), ("year", pa.int16()), ("accident_num", pa.int32())]
+)
+# One float32 column per type of bike lane is added after these ones, see `compact_features`
+BIKE_LANE_FEATURES_SCHEMA = pa.schema([("insee_com", pa.string()), ("length", pa.float32())])
+# One float32 column per type of bike lane is added after these ones
+LANE_DISTANCE_FEATURES_SCHEMA = pa.schema(
+    [("code_commune", pa.string()), ("accidents", pa.int32()), ("near_lane_share", pa.float32())]
+)
+ROADS_FEATURES_SCHEMA = pa.schema([("insee_com", pa.string()), ("road length", pa.float32())])
+# The per-type lengths of BIKE_LANE_FEATURES_SCHEMA are added after these columns
+TRAINING_DATA_SCHEMA = pa.schema(
+    [
+        ("population", pa.int32()),
+        ("code_commune", pa.string()),
+        ("lat", pa.float32()),
+        ("long", pa.float32()),
+        ("area", pa.float32()),
+        ("accident_num", pa.int32()),
+        ("length", pa.float32()),
+        ("road length", pa.float32()),
+    ]
+)
+
+
+def normalize_commune_codes(codes: pd.Series) -> pd.Series:
+    """Converts INSEE commune codes to 5 characters strings, e.g. 1001 -> "01001".
+
+    Args:
+        codes (pd.Series): commune codes, either as integers or as strings
+
+    Returns:
+        pd.Series: the commune codes as strings
+    """
+    if pd.api.types.is_numeric_dtype(codes):
+        codes = codes.astype("Int64")
+    return codes.astype("string").str.zfill(5).astype(object)
+
+
+def department_code(codes: pd.Series) -> pd.Series:
+    """Extracts the département from INSEE commune codes: 3 characters for overseas
+    départements (97x), 2 characters otherwise (including "2A" and "2B" for Corsica).
+
+    Args:
+        codes (pd.Series): normalized commune codes, see `normalize_commune_codes`
+
+    Returns:
+        pd.Series: the département codes
+    """
+    codes = codes.astype("string")
+    return codes.str[:2].mask(codes.str.startswith("97"), codes.str[:3]).astype(object)
+
+
+def in_department(df: pd.DataFrame, columns: list[str], department: str) -> np.ndarray:
+    """Tells which rows have one of their commune codes in a département.
+
+    Args:
+        df (pd.DataFrame): rows with commune codes, e.g. the "code_com_d" and "code_com_g" of the bike lanes
+        columns (list[str]): columns containing INSEE commune codes
+        department (str): code of the département, e.g. "75", "2A" or "971"
+
+    Returns:
+        np.ndarray: boolean mask of the rows in the département
+    """
+    return np.logical_or.reduce(
+        [department_code(normalize_commune_codes(df[column])).eq(department).to_numpy(dtype=bool) for column in columns]
+    )
+
+
+def write_features(
+    df: pd.DataFrame,
+    path: str,
+    schema: pa.Schema,
+    commune_column: str = "code_commune",
+    metadata: dict[str, str] | None = None,
+) -> pd.DataFrame:
+    """Saves a feature table as a parquet file, with the compact types of `compact_features`.
+    The commune codes are normalized and the rows sorted by commune, and a département column is added
+    so that `read_features` can skip the row groups that are not needed. The file is replaced atomically.
+
+    Args:
+        df (pd.DataFrame): the features to save
+        path (str): destination parquet file
+        schema (pa.Schema): types of the known columns. Columns that are not in the schema keep their inferred type.
+        commune_column (str, optional): column containing the INSEE code of the communes. Defaults to "code_commune".
+        metadata (dict[str, str], optional): key-value pairs saved in the file, see `read_metadata`. Defaults to None.
+
+    Returns:
+        pd.DataFrame: the saved dataframe, with normalized commune codes and the compact types of the schema
+    """
+    df = df.copy()
+    df[commune_column] = normalize_commune_codes(df[commune_column])
+    df = df.sort_values(commune_column, ignore_index=True, kind="stable")
+    df = compact_features(df, schema, commune_column)
+
+    codes = df[commune_column].astype(object)
+    stored = df.assign(**{commune_column: codes, DEPARTMENT_COLUMN: department_code(codes)})
+    table = pa.Table.from_pandas(stored, schema=_complete_schema(schema, stored), preserve_index=False)
+    if metadata:
+        encoded = {key.encode(): value.encode() for key, value in metadata.items()}
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **encoded})
+    with atomic_path(path) as tmp_path:
+        pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    return df
+
+
+def read_features(
+    path: str,
+    columns: list[str] | None = None,
+    communes: Iterable[str] | None = None,
+    departments: Iterable[str] | None = None,
+    commune_column: str = "code_commune",
+) -> pd.DataFrame:
+    """Loads a feature table saved with `write_features`.
+
+    Args:
+        path (str): parquet file to read
+        columns (list[str], optional): columns to load. Defaults to None, meaning all the columns.
+        communes (Iterable[str], optional): INSEE codes of the communes to load. Defaults to None, meaning all.
+        departments (Iterable[str], optional): codes of the départements to load. Defaults to None, meaning all.
+        commune_column (str, optional): column containing the INSEE code of the communes. Defaults to "code_commune".
+
+    Returns:
+        pd.DataFrame: the requested part of the feature table, with the strings (commune codes) as COMMUNE_CODE_DTYPE
+    """
+    filters = []
+    if communes is not None:
+        filters.append((commune_column, "in", list(communes)))
+    if departments is not None:
+        filters.append((DEPARTMENT_COLUMN, "in", list(departments)))
+
+    if columns is None:
+        columns = [name for name in pq.read_schema(path).names if name != DEPARTMENT_COLUMN]
+    table = pq.read_table(path, columns=columns, filters=filters or None)
+    return table.to_pandas(types_mapper={pa.string(): COMMUNE_CODE_DTYPE}.get)
+
+
+def read_metadata(path: str) -> dict[str, str]:
+    """Loads the metadata saved by `write_features` along with a feature table, without reading the table.
+
+    Args:
+        path (str): parquet file to read
+
+    Returns:
+        dict[str, str]: the metadata of the table
+    """
+    metadata = pq.read_schema(path).metadata or {}
+    return {key.decode(): value.decode() for key, value in metadata.items() if key != b"pandas"}
+
+
+def filter_features(
+    df: pd.DataFrame,
+    columns: list[str] | None = None,
+    communes: Iterable[str] | None = None,
+    departments: Iterable[str] | None = None,
+    commune_column: str = "code_commune",
+) -> pd.DataFrame:
+    """Applies the same selection as `read_features` to a dataframe already in memory.
+
+    Args:
+        df (pd.DataFrame): the feature table, with normalized commune codes
+        columns (list[str], optional): columns to keep. Defaults to None, meaning all the columns.
+        communes (Iterable[str], optional): INSEE codes of the communes to keep. Defaults to None, meaning all.
+        departments (Iterable[str], optional): codes of the départements to keep. Defaults to None, meaning all.
+        commune_column (str, optional): column containing the INSEE code of the communes. Defaults to "code_commune".
+
+    Returns:
+        pd.DataFrame: the requested part of the feature table
+    """
+    mask = pd.Series(True, index=df.index)
+    if communes is not None:
+        mask &= df[commune_column].isin(list(communes))
+    if departments is not None:
+        mask &= department_code(df[commune_column]).isin(list(departments))
+    df = df[mask].reset_index(drop=True)
+    return df if columns is None else df[columns]
+
+
+def compact_features(
+    df: pd.DataFrame, schema: pa.Schema, commune_column: str = "code_commune", sparse: bool = False
+) -> pd.DataFrame:
+    """Converts a feature table to compact types: the columns of the schema get its types, the other float
+    columns (the per-type lengths of the bike lanes) are converted to float32, and the commune codes to
+    COMMUNE_CODE_DTYPE.
+
+    Args:
+        df (pd.DataFrame): the feature table, with normalized commune codes
+        schema (pa.Schema): types of the known columns
+        commune_column (str, optional): column containing the INSEE code of the communes. Defaults to "code_commune".
+        sparse (bool, optional): store the float columns that are not in the schema as sparse columns, most of
+            the communes have no bike lane of a given type. Defaults to False.
+
+    Returns:
+        pd.DataFrame: a copy of the feature table with compact types
+    """
+    extra_columns = [name for name in df.columns if name not in schema.names and is_float_dtype(df[name])]
+    dtypes = {
+        name: schema.field(name).type.to_pandas_dtype()
+        for name in df.columns
+        if name in schema.names and name != commune_column and not pa.types.is_string(schema.field(name).type)
+    }
+    extra_dtype = pd.SparseDtype(np.float32, 0) if sparse else np.float32
+    dtypes.update({name: extra_dtype for name in extra_columns})
+    df = df.astype(dtypes)
+    if commune_column in df.columns:
+        df[commune_column] = df[commune_column].astype(COMMUNE_CODE_DTYPE)
+    return df
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Measures the memory used by each column of a dataframe, including the strings of the object columns.
+
+    Args:
+        df (pd.DataFrame): the dataframe to measure
+
+    Returns:
+        pd.DataFrame: the "dtype" and the number of "bytes" of each column, the largest first
+    """
+    usage = df.memory_usage(index=False, deep=True)
+    return pd.DataFrame({"dtype": df.dtypes.astype(str), "bytes": usage}).sort_values("bytes", ascending=False)
+
+
+def _complete_schema(schema: pa.Schema, df: pd.DataFrame) -> pa.Schema:
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    return pa.schema([schema.field(name) if name in schema.names else inferred.field(name) for name in df.columns])
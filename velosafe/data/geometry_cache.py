@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+from velosafe.data.atomic import atomic_path
+from velosafe.data.projection import project_geometries
+from velosafe.data.readers import BATCH_SIZE, iter_geometry_batches
+
+# Projected coordinate system (unit = metre) in which every geometry stage measures lengths and distances
+PROJECTED_EPSG = 2154
+PROJECTED_CRS = f"EPSG:{PROJECTED_EPSG}"
+
+GEOMETRY_COLUMN = "geometry"
+# Length of each geometry, in the unit of the coordinate system of the cache
+LENGTH_COLUMN = "length"
+# Bounding box of each geometry, stored so that `read_geometry_cache` can skip the row groups outside of a box
+BOUNDS_COLUMNS = ["minx", "miny", "maxx", "maxy"]
+# A tenth of a batch, which is sorted on its own: each row group holds a few bands of the batch, so the statistics
+# of its bounds cover a small area
+ROW_GROUP_SIZE = BATCH_SIZE // 10
+# Side of the bands in which the geometries are sorted, so that each row group covers a small area
+_BAND_SIZE = 10_000
+
+
+def build_geometry_cache(
+    source_path: str,
+    path: str,
+    columns: list[str] | None = None,
+    source_crs: str = "EPSG:4326",
+    crs: str = PROJECTED_CRS,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Reads a vector file (shapefile, GeoJSON...), projects its geometries and saves them in a parquet file,
+    as WKB, along with some of their attributes and their length. Reading this file is much faster than reading
+    the source. The file is written batch by batch, so the memory used is bounded by the batch size.
+
+    Args:
+        source_path (str): path of the vector file
+        path (str): destination parquet file
+        columns (list[str], optional): attributes to keep. Defaults to None, meaning only the geometries.
+        source_crs (str, optional): coordinate reference system of the vector file. Defaults to "EPSG:4326".
+        crs (str, optional): coordinate reference system of the saved geometries. Defaults to PROJECTED_CRS.
+        batch_size (int, optional): number of features read at once. Defaults to BATCH_SIZE.
+
+    Returns:
+        int: the number of saved geometries
+    """
+    n_geometries = 0
+    with atomic_path(path) as tmp_path:
+        writer = None
+        try:
+            for attributes, geometries in iter_geometry_batches(source_path, columns, batch_size):
+                table = geometry_table(attributes, project_geometries(geometries, source_crs, crs), crs)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                # Attributes missing from a whole batch are read as nulls, of the type of the first batch
+                writer.write_table(table.cast(writer.schema), row_group_size=ROW_GROUP_SIZE)
+                n_geometries += len(geometries)
+            if writer is None:
+                empty = pd.DataFrame({column: pd.Series(dtype=object) for column in columns or []})
+                pq.write_table(geometry_table(empty, np.empty(0, dtype=object), crs), tmp_path)
+        finally:
+            if writer is not None:
+                writer.close()
+    return n_geometries
+
+
+def geometry_table(attributes: pd.DataFrame, geometries: np.ndarray, crs: str) -> pa.Table:
+    """Converts geometries and their attributes to the table saved by `build_geometry_cache`.
+    The rows are sorted by location, in bands of `_BAND_SIZE` units. Since the cache is written one batch at a
+    time, each batch is sorted on its own, then split in row groups of ROW_GROUP_SIZE rows.
+
+    Args:
+        attributes (pd.DataFrame): attributes of the geometries
+        geometries (np.ndarray): shapely geometries
+        crs (str): coordinate reference system of the geometries, saved in the metadata of the table
+
+    Returns:
+        pa.Table: the bounds, WKB and length of the geometries, followed by their attributes
+    """
+    bounds = shapely.bounds(geometries).reshape(-1, 4)
+    order = np.lexsort((bounds[:, 0], np.floor(bounds[:, 1] / _BAND_SIZE)))
+
+    columns = {column: pa.array(bounds[order, i]) for i, column in enumerate(BOUNDS_COLUMNS)}
+    columns[GEOMETRY_COLUMN] = pa.array(shapely.to_wkb(geometries[order]), pa.binary())
+    columns[LENGTH_COLUMN] = pa.array(shapely.length(geometries[order]), pa.float64())
+    table = pa.table(columns, metadata={"crs": crs})
+    for column in attributes:
+        values = attributes[column].iloc[order]
+        # Text attributes are always strings, even in a batch where they are all missing
+        table = table.append_column(column, pa.array(values, pa.string() if values.dtype == object else None))
+    return table
+
+
+def read_geometry_cache(
+    path: str, columns: list[str] | None = None, bbox: tuple[float, float, float, float] | None = None
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """Loads geometries saved with `build_geometry_cache`.
+
+    Args:
+        path (str): parquet file to read
+        columns (list[str], optional): attributes to load. Defaults to None, meaning only the geometries.
+        bbox (tuple[float, float, float, float], optional): load only the geometries whose bounding box
+            intersects this (minx, miny, maxx, maxy) box. Defaults to None, meaning all.
+
+    Returns:
+        tuple[pd.DataFrame, np.ndarray]: the attributes of the geometries, and the shapely geometries
+    """
+    table = pq.read_table(path, columns=(columns or []) + [GEOMETRY_COLUMN], filters=_bbox_filters(bbox))
+    geometries = shapely.from_wkb(table.column(GEOMETRY_COLUMN).combine_chunks().to_numpy(zero_copy_only=False))
+    return table.drop([GEOMETRY_COLUMN]).to_pandas(), np.asarray(geometries, dtype=object)
+
+
+def read_cached_attributes(
+    path: str, columns: list[str], bbox: tuple[float, float, float, float] | None = None
+) -> pd.DataFrame:
+    """Loads only the attributes of geometries saved with `build_geometry_cache`, such as their LENGTH_COLUMN,
+    without reading nor decoding the geometries.
+
+    Args:
+        path (str): parquet file to read
+        columns (list[str]): attributes to load
+        bbox (tuple[float, float, float, float], optional): load only the attributes of the geometries whose
+            bounding box intersects this (minx, miny, maxx, maxy) box. Defaults to None, meaning all.
+
+    Returns:
+        pd.DataFrame: the attributes of the geometries
+    """
+    return pq.read_table(path, columns=columns, filters=_bbox_filters(bbox)).to_pandas()
+
+
+def _bbox_filters(bbox: tuple[float, float, float, float] | None) -> list[tuple] | None:
+    if bbox is None:
+        return None
+    minx, miny, maxx, maxy = bbox
+    return [("maxx", ">=", minx), ("minx", "<=", maxx), ("maxy", ">=", miny), ("miny", "<=", maxy)]
@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import shapely
+
+# Number of (polygon, line) pairs intersected at once by a worker
+CHUNK_SIZE = 50_000
+
+
+def pair_intersection_lengths(
+    lines: np.ndarray, polygons: np.ndarray, pairs: np.ndarray, line_lengths: np.ndarray | None = None
+) -> np.ndarray:
+    """Computes the length of the part of the line inside the polygon, for each (polygon, line) pair.
+    If the lengths of the lines are given, the pairs are first classified with `contains_properly`:
+    the lines contained in the polygon keep their length, and the exact intersection is only computed
+    for the lines crossing the boundary of the polygon. The polygons should then be prepared.
+
+    Args:
+        lines (np.ndarray): array of shapely lines
+        polygons (np.ndarray): array of shapely polygons
+        pairs (np.ndarray): indices of the (polygon, line) pairs, with shape (2, n), as returned by `STRtree.query`
+        line_lengths (np.ndarray, optional): length of each line, enables the containment shortcut.
+            Defaults to None.
+
+    Returns:
+        np.ndarray: the length of the intersection of each pair
+    """
+    polygon_index, line_index = pairs
+    if line_lengths is None:
+        return shapely.length(shapely.intersection(lines.take(line_index), polygons.take(polygon_index)))
+    lengths = line_lengths.take(line_index)
+    crossing = ~shapely.contains_properly(polygons.take(polygon_index), lines.take(line_index))
+    lengths[crossing] = shapely.length(
+        shapely.intersection(lines.take(line_index[crossing]), polygons.take(polygon_index[crossing]))
+    )
+    return lengths
+
+
+def intersection_lengths(
+    lines: np.ndarray,
+    polygons: np.ndarray,
+    pairs: np.ndarray,
+    chunk_size: int = CHUNK_SIZE,
+    n_jobs: int | None = None,
+    containment_shortcut: bool = True,
+) -> np.ndarray:
+    """Computes, for each polygon, the total length of the lines inside it.
+    The candidate pairs are processed by chunks in a thread pool, and only the running sum per polygon is kept,
+    so the memory used by the intersected geometries is bounded by the chunk size.
+    Most lines lie entirely inside a single polygon: with the containment shortcut, the pairs are first
+    classified with `contains_properly` on prepared polygons, and the exact intersection is only computed
+    for the lines crossing the boundary of the polygon.
+
+    Args:
+        lines (np.ndarray): array of shapely lines
+        polygons (np.ndarray): array of shapely polygons
+        pairs (np.ndarray): indices of the (polygon, line) pairs to intersect, with shape (2, n),
+            as returned by `STRtree.query`
+        chunk_size (int, optional): number of pairs intersected at once by a worker. Defaults to CHUNK_SIZE.
+        n_jobs (int, optional): number of workers. Defaults to None, meaning the number of CPUs.
+        containment_shortcut (bool, optional): skip the intersection of the lines contained in the polygon.
+            Defaults to True.
+
+    Returns:
+        np.ndarray: the length of lines inside each polygon
+    """
+    if containment_shortcut:
+        shapely.prepare(polygons)
+        line_lengths = shapely.length(lines)
+    else:
+        line_lengths = None
+
+    def chunk_lengths(start: int) -> np.ndarray:
+        chunk = pairs[:, start : start + chunk_size]
+        lengths = pair_intersection_lengths(lines, polygons, chunk, line_lengths)
+        return np.bincount(chunk[0], weights=lengths, minlength=len(polygons))
+
+    totals = np.zeros(len(polygons))
+    # shapely releases the GIL in its vectorized operations: threads run in parallel without copying the geometries
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        for lengths in executor.map(chunk_lengths, range(0, pairs.shape[1], chunk_size)):
+            totals += lengths
+    return totals
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field, replace
+from typing import Any
+
+from velosafe.data.atomic import atomic_path
+from velosafe.data.download import RemoteFile
+
+
+@dataclass
+class Stage:
+    """A step of the datagen pipeline, whose output is cached in the data folder.
+
+    The cached output is only reused if it was computed from the same inputs: its key combines the md5 of the
+    input files, the parameters of the stage, its code version and the keys of the stages it depends on.
+    Bump `version` whenever the code of the stage changes its output.
+
+    A stage can be restricted to the communes of one département, see `shard`: each shard has its own cached
+    output, in the "shards/<département>" subfolder of the data folder. Stages that are not `shardable` are
+    shared by all the shards.
+    """
+
+    name: str
+    filename: str
+    inputs: list[RemoteFile] = field(default_factory=list)
+    params: dict[str, Any] = field(default_factory=dict)
+    depends_on: list["Stage"] = field(default_factory=list)
+    version: str = "1"
+    department: str | None = None
+    shardable: bool = True
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}[{self.department}]" if self.department else self.name
+
+    def shard(self, department: str) -> "Stage":
+        """
+        Restrict the stage, and the stages it depends on, to the communes of a département.
+        """
+        if not self.shardable:
+            return self
+        return replace(self, department=department, depends_on=[stage.shard(department) for stage in self.depends_on])
+
+    def key(self) -> str:
+        """
+        Compute the content address of the stage output.
+        """
+        description = {
+            "name": self.name,
+            "version": self.version,
+            "inputs": [remote_file.expected_md5sum() or remote_file.url for remote_file in self.inputs],
+            "params": self.params,
+            "depends_on": [stage.key() for stage in self.depends_on],
+        }
+        if self.department:
+            description["department"] = self.department
+        return hashlib.md5(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def output_path(self, data_folder: str, filename: str | None = None) -> str:
+        if self.department:
+            return os.path.join(data_folder, "shards", self.department, filename or self.filename)
+        return os.path.join(data_folder, filename or self.filename)
+
+    def is_fresh(self, data_folder: str, filename: str | None = None) -> bool:
+        """
+        Check whether the cached output exists and was built with the current key.
+        """
+        path = self.output_path(data_folder, filename)
+        if not (os.path.exists(path) and os.path.exists(_key_path(path))):
+            return False
+        with open(_key_path(path)) as f:
+            return f.read().strip() == self.key()
+
+    def mark_built(self, data_folder: str, filename: str | None = None) -> None:
+        """
+        Record the key of the output that was just written.
+        """
+        with atomic_path(_key_path(self.output_path(data_folder, filename))) as tmp_path:
+            with open(tmp_path, "w") as f:
+                f.write(self.key())
+
+
+def plan(target: Stage, data_folder: str) -> dict[str, bool]:
+    """Tells which stages must run to get an up-to-date output for the target stage.
+    A stage is skipped if its own output is up to date, or if no stage that needs it has to run.
+
+    Args:
+        target (Stage): the last stage of the pipeline
+        data_folder (str): folder containing the cached outputs
+
+    Returns:
+        dict[str, bool]: the label of each stage, mapped to True if it will be skipped
+    """
+    skipped: dict[str, bool] = {}
+
+    def visit(stage: Stage, needed: bool) -> None:
+        is_skipped = not needed or stage.is_fresh(data_folder)
+        skipped[stage.label] = skipped.get(stage.label, True) and is_skipped
+        for dependency in stage.depends_on:
+            visit(dependency, not is_skipped)
+
+    visit(target, True)
+    return skipped
+
+
+def _key_path(path: str) -> str:
+    return path + ".key"
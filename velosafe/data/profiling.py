@@ -0,0 +1,191 @@
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterator
+
+from velosafe.data.atomic import atomic_path
+
+# Records of the stages run by this process since profiling was enabled, None while it is disabled
+_profiles: list["StageProfile"] | None = None
+# Number of stages running in this process: the peak RSS is only reset when the first one starts
+_running = 0
+_lock = threading.Lock()
+# Département of the shard being built, see `profile_department`
+_department: ContextVar[str | None] = ContextVar("department", default=None)
+
+
+@dataclass
+class StageProfile:
+    """Resources used by a stage of the datagen pipeline, see `profile_stage`."""
+
+    name: str
+    department: str | None = None
+    wall_time: float = 0.0
+    # User and system time of all the threads of the process
+    cpu_time: float = 0.0
+    # Peak resident set size of the process while the stage ran, in bytes. When stages overlap, e.g. the
+    # downloads run in threads, it covers the stages that were already running when this one started.
+    peak_rss: int = 0
+    # Resident set size of the process when the stage started, in bytes, 0 if unknown
+    start_rss: int = 0
+    # Peak of the memory allocated by python and numpy during the stage, in bytes, if it was traced. The memory
+    # allocated by GEOS (shapely) is not traced.
+    allocated: int | None = None
+    rows_in: int | None = None
+    rows_out: int | None = None
+    pid: int = 0
+
+
+def enable_profiling() -> None:
+    """
+    Start recording the stages run by this process, see `profile_stage`.
+    """
+    global _profiles
+    _profiles = []
+
+
+def is_profiling() -> bool:
+    return _profiles is not None
+
+
+def collect_profiles() -> list[StageProfile]:
+    """
+    Return the stages recorded since the last call, and forget them.
+    """
+    global _profiles
+    if _profiles is None:
+        return []
+    with _lock:
+        profiles, _profiles = _profiles, []
+    return profiles
+
+
+def add_profiles(profiles: list[StageProfile]) -> None:
+    """
+    Record stages profiled in another process, e.g. a worker of a process pool.
+    """
+    if _profiles is not None:
+        with _lock:
+            _profiles.extend(profiles)
+
+
+@contextmanager
+def profile_department(department: str | None) -> Iterator[None]:
+    """
+    Tag the stages profiled in the context with the département of the shard they build.
+    """
+    token = _department.set(department)
+    try:
+        yield
+    finally:
+        _department.reset(token)
+
+
+@contextmanager
+def profile_stage(name: str, rows_in: int | None = None, trace_allocations: bool = False) -> Iterator[StageProfile]:
+    """Measures the wall time, CPU time and peak memory of the code run in the context, if profiling is enabled.
+    The row counts are set on the yielded profile by the caller, e.g. `profile.rows_out = len(df)`.
+
+    Args:
+        name (str): name of the stage
+        rows_in (int, optional): number of rows the stage reads. Defaults to None.
+        trace_allocations (bool, optional): also measure the peak of the memory allocated by the stage with
+            tracemalloc, which slows it down. Defaults to False.
+
+    Yields:
+        StageProfile: the profile of the stage, recorded when the context exits
+    """
+    global _running
+    profile = StageProfile(name, _department.get(), rows_in=rows_in, pid=os.getpid())
+    if _profiles is None:
+        yield profile
+        return
+
+    with _lock:
+        if _running == 0:
+            _reset_peak_rss()
+        _running += 1
+    profile.start_rss = _status_bytes("VmRSS")
+    if trace_allocations:
+        tracemalloc.start()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield profile
+    finally:
+        profile.wall_time = time.perf_counter() - start_wall
+        profile.cpu_time = time.process_time() - start_cpu
+        profile.peak_rss = _peak_rss()
+        if trace_allocations:
+            profile.allocated = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        with _lock:
+            _running -= 1
+            _profiles.append(profile)
+
+
+def write_profile_report(profiles: list[StageProfile], path: str, command: dict[str, Any] | None = None) -> dict:
+    """Saves the profiles of the stages in a JSON report, along with a description of the machine,
+    so that runs on different machines or versions of the code can be compared.
+
+    Args:
+        profiles (list[StageProfile]): the profiles of the stages, see `collect_profiles`
+        path (str): destination JSON file
+        command (dict[str, Any], optional): options of the profiled command. Defaults to None.
+
+    Returns:
+        dict: the saved report
+    """
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "command": command or {},
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        "stages": [asdict(profile) for profile in profiles],
+    }
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def _reset_peak_rss() -> None:
+    # Linux resets the peak RSS (VmHWM) of the process when "5" is written to clear_refs
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _status_bytes(field: str) -> int:
+    # Memory field of the process status on Linux, 0 on the other systems
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _peak_rss() -> int:
+    if peak := _status_bytes("VmHWM"):
+        return peak
+    import resource
+
+    # Peak of the whole life of the process, in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,43 @@
+import numpy as np
+import pyproj
+import shapely
+
+
+def project_geometries(geometries: np.ndarray, from_crs: str, to_crs: str) -> np.ndarray:
+    """Reprojects an array of shapely geometries.
+    The coordinates of all the geometries are transformed at once, with a single call to pyproj.
+
+    Args:
+        geometries (np.ndarray): array of shapely geometries
+        from_crs (str): current coordinate reference system of the geometries, e.g. "EPSG:4326"
+        to_crs (str): target coordinate reference system, e.g. "EPSG:2154"
+
+    Returns:
+        np.ndarray: the projected geometries, the same array if both coordinate reference systems are equal
+    """
+    if pyproj.CRS(from_crs) == pyproj.CRS(to_crs):
+        return geometries
+    transformer = pyproj.Transformer.from_crs(pyproj.CRS(from_crs), pyproj.CRS(to_crs), always_xy=True)
+
+    def transform(coords: np.ndarray) -> np.ndarray:
+        return np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+
+    return shapely.transform(geometries, transform)
+
+
+def project_coordinates(x: np.ndarray, y: np.ndarray, from_crs: str, to_crs: str) -> tuple[np.ndarray, np.ndarray]:
+    """Reprojects arrays of coordinates, see `project_geometries`.
+
+    Args:
+        x (np.ndarray): abscissas (longitudes) of the points, NaN if unknown
+        y (np.ndarray): ordinates (latitudes) of the points
+        from_crs (str): current coordinate reference system of the points, e.g. "EPSG:4326"
+        to_crs (str): target coordinate reference system, e.g. "EPSG:2154"
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the projected abscissas and ordinates, NaN where the point is unknown
+    """
+    if pyproj.CRS(from_crs) == pyproj.CRS(to_crs):
+        return x, y
+    transformer = pyproj.Transformer.from_crs(pyproj.CRS(from_crs), pyproj.CRS(to_crs), always_xy=True)
+    return transformer.transform(x, y)
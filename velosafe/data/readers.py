@@ -0,0 +1,68 @@
+from itertools import islice
+from typing import Iterator
+
+import fiona
+import numpy as np
+import pandas as pd
+from fiona.errors import DriverError
+from shapely.geometry import shape
+
+# Number of features converted at once: bounds the memory used by the intermediate python objects
+BATCH_SIZE = 10_000
+
+
+def iter_geometry_batches(
+    path: str,
+    columns: list[str] | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[tuple[pd.DataFrame, np.ndarray]]:
+    """Reads a vector file (shapefile, GeoJSON...) by batches of features.
+    Only the requested attributes are read, the others are skipped by GDAL when the driver allows it.
+
+    Args:
+        path (str): path of the file to read
+        columns (list[str], optional): attributes to read. Defaults to None, meaning only the geometries.
+        batch_size (int, optional): number of features per batch. Defaults to BATCH_SIZE.
+
+    Yields:
+        tuple[pd.DataFrame, np.ndarray]: the attributes of the features of the batch, and their geometries
+        as an array of shapely geometries
+    """
+    columns = columns or []
+    with fiona.open(path) as source:
+        ignore_fields = [name for name in source.schema["properties"] if name not in columns]
+    try:
+        source = fiona.open(path, ignore_fields=ignore_fields)
+    except DriverError:
+        # Some drivers, such as GeoJSON, cannot skip attributes: they are dropped while converting the batch
+        source = fiona.open(path)
+    with source:
+        features = iter(source)
+        while batch := list(islice(features, batch_size)):
+            attributes = pd.DataFrame([feature["properties"] for feature in batch], columns=columns)
+            geometries = np.empty(len(batch), dtype=object)
+            geometries[:] = [shape(feature["geometry"]) if feature["geometry"] else None for feature in batch]
+            yield attributes, geometries
+
+
+def read_geometries(
+    path: str,
+    columns: list[str] | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """Reads a whole vector file into an array of shapely geometries, see `iter_geometry_batches`.
+
+    Args:
+        path (str): path of the file to read
+        columns (list[str], optional): attributes to read. Defaults to None, meaning only the geometries.
+        batch_size (int, optional): number of features converted at once. Defaults to BATCH_SIZE.
+
+    Returns:
+        tuple[pd.DataFrame, np.ndarray]: the attributes of the features, and their geometries
+    """
+    batches = list(iter_geometry_batches(path, columns, batch_size))
+    if not batches:
+        return pd.DataFrame(columns=columns or []), np.empty(0, dtype=object)
+    attributes = pd.concat([attributes for attributes, _ in batches], ignore_index=True)
+    geometries = np.concatenate([geometries for _, geometries in batches])
+    return attributes, geometries
@@ -1,51 +1,47 @@
-import fiona
 import numpy as np
-import orjson
 import pandas as pd
-import pyproj
-import shapely
-from joblib import Parallel, delayed
 from shapely import STRtree
-from shapely.geometry import shape
-from shapely.ops import transform
 
-
-def build_roads_features(
-    commune_geojson_path: str, road_shapefile_path: str, communes_crs: str = "EPSG:4326", roads_crs: str = "EPSG:2154"
-):
-    with open(commune_geojson_path) as f:
-        features = orjson.loads(f.read())["features"]
-    insee_geometry = [shape(feature["geometry"]) for feature in features]
-    insee_com = [feature["properties"]["insee_com"] for feature in features]
-
-    roads = fiona.open(road_shapefile_path)
-    list_roads = [shape(road["geometry"]) for road in roads]
-    road_tree = STRtree(list_roads)
-
-    project = pyproj.Transformer.from_crs(
-        pyproj.CRS(communes_crs),  # coordinates of communes (unit = degree)
-        pyproj.CRS(roads_crs),  # coordinates of roads (unit = metre)
-        always_xy=True,
-    ).transform
-    insee_geometry_proj = Parallel(n_jobs=-1)(delayed(transform)(project, geom) for geom in insee_geometry)
-
-    res = road_tree.query(insee_geometry_proj, predicate="intersects")
-    x = road_tree.geometries.take(res[1])
-    y = np.take(insee_geometry_proj, res[0])
-    intersected = shapely.intersection(x, y)
-    lengths = shapely.length(intersected)
-
-    road_length_df = pd.DataFrame({"insee_com": np.take(insee_com, res[0]), "road length": lengths})
-    road_length_df = road_length_df.groupby("insee_com").agg({"road length": "sum"})
-    road_length_df.reset_index(inplace=True)
+from velosafe.data.overlay import CHUNK_SIZE, intersection_lengths
+from velosafe.data.profiling import profile_stage
+
+
+def get_road_length_by_commune(
+    insee_com: np.ndarray,
+    communes: np.ndarray,
+    roads: np.ndarray,
+    chunk_size: int = CHUNK_SIZE,
+    n_jobs: int | None = None,
+    containment_shortcut: bool = True,
+) -> pd.DataFrame:
+    """Computes the total length of the roads in each commune.
+
+    Args:
+        insee_com (np.ndarray): code of each commune
+        communes (np.ndarray): shapely polygons of the communes, in the projected coordinate system of the roads
+        roads (np.ndarray): shapely geometries of the roads
+        chunk_size (int, optional): number of (road, commune) pairs intersected at once. Defaults to CHUNK_SIZE.
+        n_jobs (int, optional): number of threads intersecting the chunks. Defaults to None, meaning the number
+            of CPUs.
+        containment_shortcut (bool, optional): skip the intersection of the roads contained in a commune.
+            Defaults to True.
+
+    Returns:
+        pd.DataFrame: the "insee_com" code and the "road length" of the communes crossed by at least one road
+    """
+    # The tree is built by its first query, which is profiled with it
+    with profile_stage("road STRtree build", rows_in=len(roads)) as profile:
+        road_tree = STRtree(roads)
+        res = road_tree.query(communes, predicate="intersects")
+        profile.rows_out = res.shape[1]
+
+    with profile_stage("road intersection", rows_in=res.shape[1]) as profile:
+        lengths = intersection_lengths(road_tree.geometries, communes, res, chunk_size, n_jobs, containment_shortcut)
+
+        # Only the communes crossed by at least one road are kept
+        crossed = np.bincount(res[0], minlength=len(communes)) > 0
+        road_length_df = pd.DataFrame({"insee_com": np.asarray(insee_com)[crossed], "road length": lengths[crossed]})
+        road_length_df = road_length_df.groupby("insee_com").agg({"road length": "sum"})
+        road_length_df.reset_index(inplace=True)
+        profile.rows_out = len(road_length_df)
     return road_length_df
-
-
-if __name__ == "__main__":
-
-    commune_geojson_path = "data/code-postal-code-insee-2015.geojson"
-    road_shapefile_path = "data/ROUTE500_3-0__SHP_LAMB93_FXX_2021-11-03/ROUTE500/\
-        1_DONNEES_LIVRAISON_2022-01-00175/R500_3-0_SHP_LAMB93_FXX-ED211/RESEAU_ROUTIER/TRONCON_ROUTE.shp"
-
-    road_length_df = build_roads_features(commune_geojson_path, road_shapefile_path)
-    road_length_df.to_csv("data/roads_length.csv", index=True)
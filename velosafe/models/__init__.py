@@ -1,4 +1,22 @@
+import importlib
+from typing import TYPE_CHECKING
+
 __all__ = ["grid_search", "stratified_sample", "load_model", "save_model"]
 
-from .serialize import load_model, save_model
-from .train import grid_search, stratified_sample
+# scikit-learn is only imported when one of the functions is first accessed, see velosafe.data
+_LAZY_EXPORTS = {
+    "grid_search": ".train",
+    "stratified_sample": ".train",
+    "load_model": ".serialize",
+    "save_model": ".serialize",
+}
+
+if TYPE_CHECKING:
+    from .serialize import load_model, save_model
+    from .train import grid_search, stratified_sample
+
+
+def __getattr__(name: str):
+    if name in _LAZY_EXPORTS:
+        return getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")